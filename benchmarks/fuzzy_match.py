@@ -0,0 +1,69 @@
+"""
+Play-resolution latency of the fuzzy matcher against a large candidate set.
+
+    python benchmarks/fuzzy_match.py [num_tracks]
+
+Builds the same utterences LSpotify.play scores (4 per track) for num_tracks synthetic tracks
+and times scoring a query against all of them, with the NumPy kernel and (if installed) the
+rapidfuzz kernel, plus the old per-utterence Python loop for reference.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lucyserver.tools import fuzzy
+from lucyserver.tools.fuzzy import FuzzyMatcher, top_k
+
+WORDS = ["love", "night", "fire", "wild", "heart", "summer", "dream", "river", "ghost", "gold",
+         "city", "light", "rain", "blue", "home", "stay", "run", "echo", "youth", "paper"]
+ARTISTS = ["Jeremy Zucker", "Taylor Swift", "Bon Iver", "Lorde", "Phoebe Bridgers", "The National",
+           "Hozier", "Maggie Rogers", "Novo Amor", "Lizzy McAlpine"]
+
+def build_utterences(num_tracks):
+    random.seed(0)
+    utterences = []
+    for _ in range(num_tracks):
+        name = " ".join(random.choice(WORDS) for _ in range(random.randint(1, 4)))
+        artist = random.choice(ARTISTS)
+        utterences += [name, f"the song {name}", f"{name} by {artist}", f"the song {name} by {artist}"]
+    return utterences
+
+def timed(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    num_tracks = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    utterences = build_utterences(num_tracks)
+    query = "the song wild fire by jeremy zucker"
+    print(f"{len(utterences)} candidates ({num_tracks} tracks), query '{query}'")
+
+    rapid_process = fuzzy.rapid_process
+    kernels = [("numpy", None)]
+    if rapid_process is not None:
+        kernels.append(("rapidfuzz", rapid_process))
+
+    for name, kernel in kernels:
+        fuzzy.rapid_process = kernel
+        matcher = FuzzyMatcher(utterences)
+        matcher.scores(query)  # encode the candidates once, like a warm cache
+        seconds, scores = timed(lambda: top_k(matcher.scores(query), 5))
+        print(f"{name:>10}: {seconds * 1000:8.2f} ms  best {scores[0]}")
+    fuzzy.rapid_process = rapid_process
+
+    try:
+        from fuzzywuzzy import fuzz
+    except ImportError:
+        return
+    seconds, _ = timed(lambda: max(fuzz.ratio(query, utterence.lower()) for utterence in utterences), repeat=1)
+    print(f"{'fuzzywuzzy':>10}: {seconds * 1000:8.2f} ms  (old per-utterence loop)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Audio framing for /v1/ws/{user_id}.
+
+The client picks a format in its auth message, e.g. {"type": "auth", "audio_format": "pcm16"}.
+
+json   (default) {"type": "audio", "data": <base64 float32 PCM>} text messages, as before
+pcm16  binary frames, little endian int16 PCM
+mulaw  binary frames, 8-bit mu-law companded PCM (half the size of pcm16)
+
+Binary frames start with a 16 byte little endian header:
+    magic      2s   b"LA"
+    version    B    1
+    codec      B    0 = pcm16, 1 = mulaw
+    stream_id  I    id of the utterance (frames from an old stream can be dropped)
+    sample_rate I
+    seq        I    frame number within the stream
+followed by the samples.
+
+mu-law samples decode as y = code / 255 * 2 - 1, x = sign(y) * ((1 + 255) ** |y| - 1) / 255
+"""
+import base64
+import struct
+import numpy as np
+
+FRAME_HEADER = struct.Struct("<2sBBIII")
+FRAME_MAGIC = b"LA"
+FRAME_VERSION = 1
+
+CODECS = {
+    "pcm16": 0,
+    "mulaw": 1,
+}
+AUDIO_FORMATS = ["json", *CODECS]
+
+MU = 255
+
+def negotiate_audio_format(requested):
+    if requested in AUDIO_FORMATS:
+        return requested
+    return "json"
+
+def mulaw_encode(audio):
+    audio = np.clip(audio, -1.0, 1.0)
+    magnitude = np.log1p(MU * np.abs(audio)) / np.log1p(MU)
+    return ((np.sign(audio) * magnitude + 1) / 2 * MU + 0.5).astype(np.uint8)
+
+def encode_samples(codec, audio):
+    if codec == "pcm16":
+        return (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+    if codec == "mulaw":
+        return mulaw_encode(audio).tobytes()
+    raise ValueError(f"Unknown audio codec '{codec}'")
+
+def encode_json_audio(audio):
+    output_bytes = np.asarray(audio, dtype=np.float32).tobytes()
+    return {"type": "audio", "data": base64.b64encode(output_bytes).decode('utf-8')}
+
+def encode_audio_frame(codec, stream_id, sample_rate, seq, audio):
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, CODECS[codec], stream_id & 0xFFFFFFFF, sample_rate, seq & 0xFFFFFFFF)
+    return header + encode_samples(codec, audio)
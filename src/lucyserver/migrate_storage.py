@@ -0,0 +1,48 @@
+import argparse
+import json
+import os
+
+from .tools.data_store import BASE_DIR, DB_PATH, SQLiteBackend
+
+# Keys that are dicts of independent entries, imported one row per entry
+COLLECTION_KEYS = ["liked_songs_cache", "user_playlists_cache"]
+
+def migrate(cfg_dir, db_path, collection_keys):
+    backend = SQLiteBackend(db_path)
+    count = 0
+    for user_id in sorted(os.listdir(cfg_dir)):
+        user_dir = os.path.join(cfg_dir, user_id)
+        if not os.path.isdir(user_dir):
+            continue
+        for module in sorted(os.listdir(user_dir)):
+            module_dir = os.path.join(user_dir, module)
+            if not os.path.isdir(module_dir):
+                continue
+            for file_name in sorted(os.listdir(module_dir)):
+                if not file_name.endswith(".json"):
+                    continue
+                key = file_name[:-len(".json")]
+                with open(os.path.join(module_dir, file_name), "r") as f:
+                    try:
+                        value = json.load(f)
+                    except json.JSONDecodeError as e:
+                        print(f"Skipping {user_id}/{module}/{file_name}: {e}")
+                        continue
+
+                entry_key = (user_id, module, key)
+                if key in collection_keys and isinstance(value, dict):
+                    backend.write_items(entry_key, value, value.keys(), ())
+                else:
+                    backend.write(entry_key, value)
+                count += 1
+                print(f"Imported {user_id}/{module}/{key}")
+    print(f"Imported {count} keys into {db_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import the ~/lucyserver/cfg JSON tree into the SQLite storage backend.")
+    parser.add_argument("--cfg", default=BASE_DIR, help="JSON config directory to import from")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database to import into")
+    parser.add_argument("--collections", default=",".join(COLLECTION_KEYS), help="Comma separated keys to store one row per entry")
+    args = parser.parse_args()
+    migrate(args.cfg, args.db, args.collections.split(","))
+    print("Set LUCYSERVER_STORAGE=sqlite to use it.")
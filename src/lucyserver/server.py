@@ -3,9 +3,13 @@ from fastapi.responses import StreamingResponse, HTMLResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from pydantic import BaseModel
-from .session import LucySession
+from .session import LucySession, voice, warm_voice
 from .message import Message
+from .audio_protocol import negotiate_audio_format
+from .tools.http_pool import close_clients, pool_stats
 import asyncio
+import inspect
+from contextlib import asynccontextmanager
 from importlib import resources
 
 class UserMessageRequest(BaseModel):
@@ -15,7 +19,27 @@ class UserMessageRequest(BaseModel):
 class UserRequest(BaseModel):
     user_id: str
 
-app = FastAPI()
+async def warm_up_voice():
+    try:
+        await asyncio.to_thread(warm_voice)
+    except Exception as e:
+        print("Error warming up the voice engine:", e)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Don't hold up startup, the voice engine loads while connections are already being accepted
+    warm_up = asyncio.create_task(warm_up_voice())
+    try:
+        yield
+    finally:
+        warm_up.cancel()
+        try:
+            await warm_up
+        except asyncio.CancelledError:
+            pass
+        await close_clients()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,14 +51,24 @@ app.add_middleware(
 
 sessions = {}
 
+def remove_session(user_id, dump=True):
+    session = sessions.pop(user_id)
+    if dump:
+        session.dump_to_file()
+    # Stops background work (library sync, token refresh, ...) that would otherwise keep it alive
+    session.close()
+
 @app.get("/v1/{user_id}/module/{module_name}/{path:path}")
 async def get_module(user_id: str, module_name: str, path: str, request: Request):
     if user_id not in sessions:
         return HTMLResponse("<h1>Session not found</h1>", status_code=404)
     session = sessions[user_id]
-    if module_name not in session.internal.get_tool_registry():
+    if module_name not in session.internal.tool_classes:
         return HTMLResponse("<h1>Module not loaded</h1>", status_code=404)
-    web_preview = session.internal.get_tool_registry()[module_name]["module"].get_web_preview(path, args=dict(request.query_params))
+    tool = await session.internal.ensure_tool(module_name)
+    web_preview = tool.get_web_preview(path, args=dict(request.query_params))
+    if inspect.isawaitable(web_preview):
+        web_preview = await web_preview
     if web_preview["type"] == "html":
         return HTMLResponse(web_preview["content"])
     elif web_preview["type"] == "redirect":
@@ -58,7 +92,7 @@ async def process_audio(request: Request, user_id: str):
     audio_data = np.frombuffer(audio_data, dtype=np.int16)
 
     session = sessions[user_id]
-    response = session.transcribe(audio_data)
+    response = await session.transcribe(audio_data)
     
     return {
         "transcription": response[0],
@@ -77,9 +111,10 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str = None):
 
             if data["type"] == "auth":
                 if user_id in sessions:
-                    del sessions[user_id]
-                sessions[user_id] = LucySession(user_id=user_id, websocket=websocket)
-                await websocket.send_json({"status": "authenticated"})
+                    remove_session(user_id, dump=False)
+                audio_format = negotiate_audio_format(data.get("audio_format"))
+                sessions[user_id] = LucySession(user_id=user_id, websocket=websocket, audio_format=audio_format)
+                await websocket.send_json({"status": "authenticated", "audio_format": audio_format})
 
             if user_id not in sessions:
                 continue
@@ -96,22 +131,24 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str = None):
                 starting_messages = [Message("user", user_input)]
                 asyncio.create_task(session.run(starting_messages))
             elif data["type"] == "tool_client_message":
-                args = {
-                   "message": data["data"] 
-                }
-                await session.handle_tool_message(data["tool"], "handle_message", args)
+                await session.handle_client_message(data["tool"], data["data"])
             elif data["type"] == "clear":
                 if user_id in sessions:
-                    sessions[user_id].dump_to_file()
-                    del sessions[user_id]
+                    remove_session(user_id)
                 await websocket.send_json({"status": "session cleared"})
     except WebSocketDisconnect:
         print(f"WebSocket disconnected for user {user_id}")
         if user_id in sessions:
-            sessions[user_id].dump_to_file()
-            del sessions[user_id]
+            remove_session(user_id)
 
 
+@app.get("/v1/stats")
+async def get_stats():
+    return {
+        "tts_cache": voice.cache.stats(),
+        "http_pools": pool_stats()
+    }
+
 @app.get("/", response_class=HTMLResponse)
 def get_home_page(request: Request):
     pass
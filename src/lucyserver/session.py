@@ -1,11 +1,9 @@
-from openai import OpenAI
-from bs4 import BeautifulSoup
 from io import BytesIO
-from scipy.io import wavfile
 import numpy as np
 
 from datetime import datetime
 
+import itertools
 import uuid
 import json
 import os
@@ -16,14 +14,27 @@ SYSTEM_PROMPT = resources.read_text("lucyserver", "prompt.md")
 
 
 from .tools.linternal import LInternal
-linternal = LInternal(None, None, None)
-docs = linternal.build_documentation()
+from .tools.manifest import get_tool_documentation
+docs = get_tool_documentation("internal")
 SYSTEM_PROMPT = SYSTEM_PROMPT.replace("[[INTERNAL_DOCS]]", json.dumps(docs, indent=2))
 
-from .voice.kokoro import voice
-# from .voice.elevenlabs import voice
+from .voice.kokoro import voice as voice_engine
+# from .voice.elevenlabs import voice as voice_engine
+from .voice.cache import CachedVoice
+voice = CachedVoice(voice_engine)
+
+# Max number of LLM / transcription requests in flight across every session on this server.
+# Requests past the cap wait their turn instead of piling onto the provider all at once.
+LLM_CONCURRENCY = 32
+llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+
+def warm_voice():
+    """Starts the voice engine ahead of the first request. Called in the background once the server is up."""
+    if hasattr(voice_engine, "start"):
+        voice_engine.start()
 
 def parse_llm_output(output):
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(output, "html.parser")
     children = soup.find_all(recursive=False)
     parsed = []
@@ -45,14 +56,21 @@ def parse_tool_response(result):
     return str_result
 
 from .message import Message
+from .stream_parser import StreamingTagParser, SentenceSplitter, split_sentences
+from .speech import SpeechPipeline
+from .audio_protocol import encode_json_audio, encode_audio_frame
+
+# Number of sentences synthesized ahead of the one currently being sent
+SPEECH_LOOKAHEAD = 2
 
 class LucySession:
-    def __init__(self, user_id, websocket):
+    def __init__(self, user_id, websocket, audio_format="json"):
         self.messages = [ Message("system", SYSTEM_PROMPT) ]
 
         self.lock = asyncio.Lock()
 
         self.websocket = websocket
+        self.audio_format = audio_format
 
         self.BASE_URL = "https://api.groq.com/openai/v1"
         self.MODEL_NAME = "moonshotai/kimi-k2-instruct"
@@ -61,12 +79,15 @@ class LucySession:
 
         settings = self.internal.load_data("settings", {
             "groq_api_key": "",
+            "streaming": True,
         })
 
         self.API_KEY = settings["groq_api_key"]
+        self.streaming = settings.get("streaming", True)
         self.speech_nonce = 0
 
-        self.client = OpenAI(
+        from openai import AsyncOpenAI
+        self.client = AsyncOpenAI(
             base_url=self.BASE_URL,
             api_key=self.API_KEY
         )
@@ -74,12 +95,23 @@ class LucySession:
     def get_openai_client(self):
         return self.client
 
+    async def create_completion(self, messages, **kwargs):
+        async with llm_semaphore:
+            return await self.client.chat.completions.create(
+                model=self.MODEL_NAME,
+                messages=messages,
+                **kwargs
+            )
+
     def messages_to_openai(self, messages):
         return [message.to_openai() for message in messages]
 
     def get_static_web_preview(module_name, path, args={}):
         return LInternal.get_global_web_preview(module_name, path, args=args)
 
+    def close(self):
+        self.internal.teardown()
+
     def dump_to_file(self):
         base_dir = os.path.expanduser("~/lucyserver/session_cache")
         os.makedirs(base_dir, exist_ok=True)
@@ -93,18 +125,44 @@ class LucySession:
             json_data = [message.to_json() for message in self.messages]
             json.dump(json_data, f, indent=2)
 
+    async def stream_completion(self, messages, **kwargs):
+        async with llm_semaphore:
+            stream = await self.client.chat.completions.create(
+                model=self.MODEL_NAME,
+                messages=messages,
+                stream=True,
+                **kwargs
+            )
+            try:
+                async for chunk in stream:
+                    if len(chunk.choices) == 0:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield delta
+            finally:
+                await stream.close()
+
     async def handle_tool_message(self, module, function, args):
         # args = {message: INIT_SPOTIFY}
         if not self.internal.tool_is_imported(module):
             return Message("error", f"Module '{module}' not imported.")
 
-        args["self"] = self.internal.get_tool_registry()[module]["module"]
+        try:
+            tool = await self.internal.ensure_tool(module)
+        except Exception as e:
+            return Message("error", f"Module '{module}' failed to load: {str(e)}")
 
-        if function not in self.internal.get_tool_registry()[module]:
+        if not tool.has_function(function):
             return Message("error", f"Function '{function}' not found in module '{module}'.")
+
+        try:
+            call = tool.bind_call(function, args)
+        except TypeError as e:
+            return Message("error", f"Invalid arguments for '{module}.{function}': {str(e)}")
         
         try:
-            result = await self.internal.get_tool_registry()[module][function](**args)
+            result = await call
         except Exception as e:
             return Message("error", f"Module '{module}' function '{function}' raised an exception: {str(e)}")
         
@@ -119,12 +177,25 @@ class LucySession:
 
         result = parse_tool_response(result)
         return Message("tool_response", result)
+
+    async def handle_client_message(self, module, message):
+        """Passes a tool_client_message from the client to the tool's handle_message."""
+        if not self.internal.tool_is_imported(module):
+            return Message("error", f"Module '{module}' not imported.")
+
+        try:
+            tool = await self.internal.ensure_tool(module)
+        except Exception as e:
+            return Message("error", f"Module '{module}' failed to load: {str(e)}")
+
+        try:
+            result = await tool.handle_message(message)
+        except Exception as e:
+            return Message("error", f"Module '{module}' raised an exception handling a client message: {str(e)}")
+        return Message("tool_response", parse_tool_response(result))
         
-    def get_next_action(self):
-        completion = self.client.chat.completions.create(
-            model=self.MODEL_NAME,
-            messages= self.messages_to_openai(self.messages),
-        )
+    async def get_next_action(self):
+        completion = await self.create_completion(self.messages_to_openai(self.messages))
         raw_output = completion.choices[0].message.content
         output = parse_llm_output(raw_output)
         if len(output) == 0:
@@ -135,6 +206,66 @@ class LucySession:
         output = output[0]
         return Message(output["tag"], output["content"])
 
+    async def stream_next_action(self):
+        """
+        Streams the next action from the LLM. Assistant text is sent to the websocket and to
+        the voice engine sentence by sentence while it is generated, and the stream is cut off
+        as soon as the first tag closes (only the first tag is ever used).
+
+        Returns (message, spoken) where spoken is True if the message was already spoken.
+        """
+        parser = StreamingTagParser()
+        splitter = SentenceSplitter()
+        sentences = None
+        events = []
+
+        tokens = self.stream_completion(self.messages_to_openai(self.messages))
+        try:
+            async for token in tokens:
+                events = parser.feed(token)
+                for kind, tag, text in events:
+                    if tag != "assistant":
+                        continue
+                    if kind == "open":
+                        if sentences is not None:
+                            # Finish the previous assistant tag's speech before starting another
+                            await self.queue_sentences(splitter.flush(), sentences)
+                            sentences.put_nowait(None)
+                        sentences = asyncio.Queue()
+                        asyncio.create_task(self.speak_stream(sentences))
+                    elif kind == "text":
+                        await self.queue_sentences(splitter.feed(text), sentences)
+                if any(kind == "close" for kind, _, _ in events):
+                    break
+            else:
+                events = parser.finish()
+
+            if sentences is not None:
+                await self.queue_sentences(splitter.flush(), sentences)
+        finally:
+            try:
+                await tokens.aclose()
+            finally:
+                # Always end the speech, even if the stream failed, or speak_stream waits forever
+                if sentences is not None:
+                    sentences.put_nowait(None)
+
+        for kind, tag, content in events:
+            if kind == "close":
+                return Message(tag, content), tag == "assistant"
+
+        if len(parser.raw) < 5:
+            return Message("end", ""), False
+        return Message("assistant", parser.raw), False
+
+    async def queue_sentences(self, new_sentences, sentences):
+        for sentence in new_sentences:
+            await self.websocket.send_json({
+                "type": "assistant_partial",
+                "data": sentence
+            })
+            sentences.put_nowait(sentence)
+
     async def run(self, starting_messages):
         async with self.lock:
             await self.internal.undo_wake_word_identified()
@@ -144,10 +275,13 @@ class LucySession:
             while True:
                 await asyncio.sleep(0.01)
 
+                spoken = False
                 if len(starting_messages_mut) > 0:
                     message = starting_messages_mut.pop(0)
+                elif self.streaming:
+                    message, spoken = await self.stream_next_action()
                 else:
-                    message = self.get_next_action()
+                    message = await self.get_next_action()
 
                 self.messages.append(message)
                 self.print_conversation()
@@ -182,26 +316,37 @@ class LucySession:
                         "type": "assistant",
                         "data": content
                     })
-                    asyncio.create_task(self.speak(content))
+                    if not spoken:
+                        asyncio.create_task(self.speak(content))
                 if tag == "user":
                     continue
                     
-    def transcribe(self, audio):
+    async def transcribe(self, audio):
+        from scipy.io import wavfile
         wav_buffer = BytesIO()
         wav_buffer.name = "audio.wav"
         wavfile.write(wav_buffer, 16000, audio.astype(np.int16))
         wav_buffer.seek(0)
 
-        transcription = self.client.audio.transcriptions.create(
-            file=wav_buffer,
-            model="whisper-large-v3-turbo",
-            response_format="text",
-            language="en",
-            temperature=0.0
-        )
+        async with llm_semaphore:
+            transcription = await self.client.audio.transcriptions.create(
+                file=wav_buffer,
+                model="whisper-large-v3-turbo",
+                response_format="text",
+                language="en",
+                temperature=0.0
+            )
         return transcription, "incomplete_query"
     
     async def speak(self, text):
+        sentences = asyncio.Queue()
+        for sentence in split_sentences(text):
+            sentences.put_nowait(sentence)
+        sentences.put_nowait(None)
+        await self.speak_stream(sentences)
+
+    async def speak_stream(self, sentences):
+        """Speaks text pulled from the sentences queue until a None is received."""
         self.is_speaking = True
         
         self.speech_nonce += 1
@@ -210,11 +355,22 @@ class LucySession:
         await self.websocket.send_json({
             "type": "speech_start",
         })
+        await self.websocket.send_json({
+            "type": "speech_sr",
+            "sr": voice.sample_rate
+        })
 
-        for audio_chunk in voice.generate(text):
-            if this_speech_nonce != self.speech_nonce:
-                break
-            await self.websocket.send_json(audio_chunk)
+        seq = itertools.count()
+        async def send_audio(audio):
+            await self.send_audio(this_speech_nonce, next(seq), audio)
+
+        pipeline = SpeechPipeline(
+            voice,
+            send_audio,
+            lambda: this_speech_nonce == self.speech_nonce,
+            lookahead=SPEECH_LOOKAHEAD
+        )
+        await pipeline.run(sentences)
 
         if this_speech_nonce != self.speech_nonce:
             return
@@ -225,6 +381,12 @@ class LucySession:
 
         self.is_speaking = False
 
+    async def send_audio(self, stream_id, seq, audio):
+        if self.audio_format == "json":
+            await self.websocket.send_json(encode_json_audio(audio))
+        else:
+            await self.websocket.send_bytes(encode_audio_frame(self.audio_format, stream_id, voice.sample_rate, seq, audio))
+
     def print_conversation(self):
         print("Conversation:")
         messages = [message.to_openai() for message in self.messages]
@@ -0,0 +1,77 @@
+import asyncio
+from contextlib import aclosing
+
+class SpeechPipeline:
+    """
+    Pipelines sentence synthesis with delivery. While sentence N is being sent, up to
+    `lookahead` following sentences are already being synthesized, so long answers start
+    playing after the first sentence and never gap between sentences.
+
+    voice: voice engine with an async generate(text)
+    send: coroutine function that delivers one audio message
+    is_current: returns False once this speech has been superseded (speech_nonce changed)
+    """
+
+    def __init__(self, voice, send, is_current, lookahead=2, max_buffered_chunks=64):
+        self.voice = voice
+        self.send = send
+        self.is_current = is_current
+        self.lookahead = lookahead
+        self.max_buffered_chunks = max_buffered_chunks
+
+        self.tasks = set()
+
+    async def run(self, sentences):
+        """Speaks text pulled from the sentences queue until a None is received."""
+        slots = asyncio.Semaphore(self.lookahead)
+        ordered = asyncio.Queue()
+        producer = asyncio.create_task(self._produce(sentences, slots, ordered))
+        self.tasks.add(producer)
+
+        try:
+            while True:
+                chunks = await ordered.get()
+                if chunks is None:
+                    break
+                # This sentence is now the current one, its slot goes to the next lookahead sentence
+                slots.release()
+                while True:
+                    chunk = await chunks.get()
+                    if chunk is None:
+                        break
+                    if not self.is_current():
+                        return
+                    await self.send(chunk)
+                if not self.is_current():
+                    return
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks.clear()
+
+    async def _produce(self, sentences, slots, ordered):
+        while True:
+            text = await sentences.get()
+            if text is None or not self.is_current():
+                break
+            await slots.acquire()
+            chunks = asyncio.Queue(self.max_buffered_chunks)
+            task = asyncio.create_task(self._synthesize(text, chunks))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            ordered.put_nowait(chunks)
+        ordered.put_nowait(None)
+
+    async def _synthesize(self, text, chunks):
+        try:
+            async with aclosing(self.voice.generate(text)) as audio_chunks:
+                async for audio_chunk in audio_chunks:
+                    await chunks.put(audio_chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("Speech synthesis failed:", e)
+        await chunks.put(None)
@@ -0,0 +1,127 @@
+import html
+import re
+
+SENTENCE_END = re.compile(r"([.!?][\"')\]]*)\s+|\n+")
+
+class StreamingTagParser:
+    """
+    Incrementally parses the <assistant>/<tool>/<end> tag protocol as tokens arrive.
+
+    feed() returns a list of events:
+        ("open", tag, "")        an opening tag was read
+        ("text", tag, text)      more text inside the current tag
+        ("close", tag, content)  the closing tag was read, content is the full (stripped) body
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.raw = ""
+        self.tag = None
+        self.content = ""
+
+    def feed(self, text):
+        self.raw += text
+        self.buffer += text
+        events = []
+        while self.buffer:
+            if self.tag is None:
+                if not self._read_open_tag(events):
+                    break
+            else:
+                if not self._read_tag_body(events):
+                    break
+        return events
+
+    def finish(self):
+        """Called once the stream is done. Closes a tag the model forgot to close."""
+        if self.tag is None:
+            return []
+        self.content += self.buffer
+        self.buffer = ""
+        return self._close()
+
+    def _read_open_tag(self, events):
+        start = self.buffer.find("<")
+        if start == -1:
+            self.buffer = ""
+            return False
+        end = self.buffer.find(">", start)
+        if end == -1:
+            self.buffer = self.buffer[start:]
+            return False
+
+        name = self.buffer[start + 1:end].strip()
+        self.buffer = self.buffer[end + 1:]
+        if name.startswith("/") or name == "":
+            return True
+
+        self_closing = name.endswith("/")
+        self.tag = name.rstrip("/").strip()
+        self.content = ""
+        events.append(("open", self.tag, ""))
+        if self_closing:
+            events.extend(self._close())
+        return True
+
+    def _read_tag_body(self, events):
+        closing = f"</{self.tag}>"
+        end = self.buffer.find(closing)
+        if end != -1:
+            text = self.buffer[:end]
+            self.buffer = self.buffer[end + len(closing):]
+            if text:
+                self.content += text
+                events.append(("text", self.tag, text))
+            events.extend(self._close())
+            return True
+
+        # Hold back anything that could be the start of the closing tag
+        hold = self.buffer.rfind("<")
+        if hold == -1 or not closing.startswith(self.buffer[hold:]):
+            hold = len(self.buffer)
+        text = self.buffer[:hold]
+        self.buffer = self.buffer[hold:]
+        if text:
+            self.content += text
+            events.append(("text", self.tag, text))
+        return False
+
+    def _close(self):
+        tag = self.tag
+        content = html.unescape(self.content.strip())
+        self.tag = None
+        self.content = ""
+        return [("close", tag, content)]
+
+
+class SentenceSplitter:
+    """Buffers streamed text and hands back complete sentences."""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        self.buffer += text
+        sentences = []
+        while True:
+            match = SENTENCE_END.search(self.buffer)
+            if match is None:
+                break
+            end = match.end(1) if match.group(1) else match.start()
+            sentence = self.buffer[:end].strip()
+            self.buffer = self.buffer[match.end():]
+            if sentence:
+                sentences.append(html.unescape(sentence))
+        return sentences
+
+    def flush(self):
+        sentence = self.buffer.strip()
+        self.buffer = ""
+        if not sentence:
+            return []
+        return [html.unescape(sentence)]
+
+
+def split_sentences(text):
+    splitter = SentenceSplitter()
+    return splitter.feed(text) + splitter.flush()
@@ -0,0 +1,340 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+BASE_DIR = os.path.expanduser("~/lucyserver/cfg")
+DB_PATH = os.path.expanduser("~/lucyserver/lucyserver.db")
+
+# "json" keeps the ~/lucyserver/cfg/<user>/<module>/<key>.json layout, "sqlite" uses DB_PATH.
+# Existing JSON data can be imported with `python -m lucyserver.migrate_storage`.
+STORAGE_BACKEND = os.environ.get("LUCYSERVER_STORAGE", "json")
+
+class JsonFileBackend:
+    """One JSON file per key. Collections are rewritten in full."""
+
+    def __init__(self, base_dir=BASE_DIR):
+        self.base_dir = base_dir
+
+    def path(self, user_id, module, key):
+        return os.path.join(self.base_dir, user_id, module, f"{key}.json")
+
+    def read(self, entry_key):
+        """Returns (value, size). Raises KeyError if the key was never saved."""
+        file_path = self.path(*entry_key)
+        try:
+            with open(file_path, "r") as f:
+                value = json.load(f)
+        except FileNotFoundError:
+            raise KeyError(entry_key)
+        return value, os.path.getsize(file_path)
+
+    def write(self, entry_key, value):
+        """Writes the whole value and returns its serialized size."""
+        file_path = self.path(*entry_key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        data = json.dumps(value, indent=4)
+
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+        return len(data)
+
+    def write_items(self, entry_key, value, changed, removed):
+        """Writes the changed/removed items of a dict value and returns its serialized size."""
+        return self.write(entry_key, value)
+
+
+class SQLiteBackend:
+    """
+    Everything in one SQLite database in WAL mode.
+
+    Plain keys are stored as one JSON value. Collections (dicts saved through save_items) are
+    stored one row per item, so changing one item writes one row.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS data (
+                user_id TEXT NOT NULL,
+                module TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                collection INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, module, key)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                user_id TEXT NOT NULL,
+                module TEXT NOT NULL,
+                key TEXT NOT NULL,
+                item_key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (user_id, module, key, item_key)
+            )
+        """)
+
+    def read(self, entry_key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, collection FROM data WHERE user_id = ? AND module = ? AND key = ?", entry_key
+            ).fetchone()
+            if row is None:
+                raise KeyError(entry_key)
+            if not row[1]:
+                return json.loads(row[0]), len(row[0])
+
+            value = {}
+            size = 0
+            rows = self.conn.execute(
+                "SELECT item_key, value FROM items WHERE user_id = ? AND module = ? AND key = ? ORDER BY rowid", entry_key
+            )
+            for item_key, item_value in rows:
+                value[item_key] = json.loads(item_value)
+                size += len(item_value)
+            return value, size
+
+    def write(self, entry_key, value):
+        data = json.dumps(value)
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute("DELETE FROM items WHERE user_id = ? AND module = ? AND key = ?", entry_key)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO data (user_id, module, key, value, collection) VALUES (?, ?, ?, ?, 0)",
+                    (*entry_key, data)
+                )
+                self.conn.execute("COMMIT")
+            except:
+                self.conn.execute("ROLLBACK")
+                raise
+        return len(data)
+
+    def write_items(self, entry_key, value, changed, removed):
+        # Serialize outside the lock, this is the expensive part
+        rows = [(*entry_key, item_key, json.dumps(value[item_key])) for item_key in list(changed) if item_key in value]
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT collection FROM data WHERE user_id = ? AND module = ? AND key = ?", entry_key
+            ).fetchone()
+            is_collection = row is not None and row[0]
+            if not is_collection:
+                # Stored as a plain value (or not at all) so far, switch it to one row per item
+                rows = [(*entry_key, item_key, json.dumps(item)) for item_key, item in list(value.items())]
+                removed = ()
+
+            self.conn.execute("BEGIN")
+            try:
+                if not is_collection:
+                    self.conn.execute("DELETE FROM items WHERE user_id = ? AND module = ? AND key = ?", entry_key)
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO data (user_id, module, key, value, collection) VALUES (?, ?, ?, NULL, 1)",
+                        entry_key
+                    )
+                self.conn.executemany(
+                    "DELETE FROM items WHERE user_id = ? AND module = ? AND key = ? AND item_key = ?",
+                    [(*entry_key, item_key) for item_key in removed]
+                )
+                self.conn.executemany(
+                    """INSERT INTO items (user_id, module, key, item_key, value) VALUES (?, ?, ?, ?, ?)
+                       ON CONFLICT (user_id, module, key, item_key) DO UPDATE SET value = excluded.value""",
+                    rows
+                )
+                self.conn.execute("COMMIT")
+            except:
+                self.conn.execute("ROLLBACK")
+                raise
+            size = self.conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM items WHERE user_id = ? AND module = ? AND key = ?", entry_key
+            ).fetchone()[0]
+        return size
+
+
+def create_backend(name=STORAGE_BACKEND):
+    if name == "sqlite":
+        return SQLiteBackend()
+    return JsonFileBackend()
+
+
+class DataStore:
+    """
+    In-memory cache in front of the storage backend.
+
+    Reads are served from memory after the first load. Writes only mark the key dirty; a
+    background writer batches dirty keys and hands them to the backend every flush_interval
+    seconds. Clean keys are evicted least recently used first once their (approximate,
+    serialized) size goes over max_clean_bytes.
+
+    Values are shared, not copied: callers that change a loaded value must save it again.
+    """
+
+    def __init__(self, backend=None, flush_interval=2.0, max_clean_bytes=64 * 1024 * 1024):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.max_clean_bytes = max_clean_bytes
+
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.clean_bytes = 0
+        # entry_key -> None if the whole value changed, or (changed item keys, removed item keys)
+        self.dirty = {}
+
+        self.wake = threading.Event()
+        self.writer = None
+        # Held while a batch is being written, so flush() at exit waits for the writer's batch
+        self.flush_lock = threading.Lock()
+        self.retry_delay = 0
+
+    def get_backend(self):
+        if self.backend is None:
+            self.backend = create_backend()
+        return self.backend
+
+    def load(self, user_id, module, key, default):
+        entry_key = (user_id, module, key)
+        with self.lock:
+            if entry_key in self.entries:
+                self.entries.move_to_end(entry_key)
+                return self.entries[entry_key]
+
+        try:
+            value, size = self.get_backend().read(entry_key)
+        except KeyError:
+            self.save(user_id, module, key, default)
+            return default
+
+        with self.lock:
+            if entry_key in self.entries:
+                # Someone saved while we were reading, theirs is newer
+                return self.entries[entry_key]
+            self.entries[entry_key] = value
+            self._set_clean_size(entry_key, size)
+            self._evict()
+        return value
+
+    def save(self, user_id, module, key, value):
+        entry_key = (user_id, module, key)
+        with self.lock:
+            self.entries[entry_key] = value
+            self.entries.move_to_end(entry_key)
+            self._set_clean_size(entry_key, None)
+            self.dirty[entry_key] = None
+            self._start_writer()
+
+    def save_items(self, user_id, module, key, items, removed=()):
+        """Adds/replaces items of a dict value and drops the removed keys. Only what changed is written."""
+        entry_key = (user_id, module, key)
+        value = self.load(user_id, module, key, {})
+        with self.lock:
+            value.update(items)
+            for item_key in removed:
+                value.pop(item_key, None)
+
+            self.entries[entry_key] = value
+            self.entries.move_to_end(entry_key)
+            self._set_clean_size(entry_key, None)
+            if entry_key not in self.dirty or self.dirty[entry_key] is not None:
+                changed_keys, removed_keys = self.dirty.get(entry_key) or (set(), set())
+                changed_keys.update(items)
+                changed_keys.difference_update(removed)
+                removed_keys.difference_update(items)
+                removed_keys.update(removed)
+                self.dirty[entry_key] = (changed_keys, removed_keys)
+            self._start_writer()
+
+    def flush(self):
+        """Writes every dirty key out now. Returns False if some writes failed (they stay dirty)."""
+        with self.flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        with self.lock:
+            batch = [(entry_key, self.entries[entry_key], changes) for entry_key, changes in self.dirty.items()]
+            self.dirty.clear()
+
+        ok = True
+        for entry_key, value, changes in batch:
+            try:
+                if changes is None:
+                    size = self.get_backend().write(entry_key, value)
+                else:
+                    size = self.get_backend().write_items(entry_key, value, *changes)
+            except (RuntimeError, OSError, sqlite3.Error) as e:
+                # RuntimeError: the value was changed while being serialized, retry next round
+                print("Error writing", entry_key, e)
+                ok = False
+                with self.lock:
+                    self.dirty[entry_key] = None
+                continue
+            except (TypeError, ValueError) as e:
+                # Not JSON serializable (a set, a circular reference, ...), retrying won't help.
+                # Drop this key and keep writing the rest of the batch.
+                print("Error serializing", entry_key, e)
+                continue
+            with self.lock:
+                if entry_key not in self.dirty and self.entries.get(entry_key) is value:
+                    self._set_clean_size(entry_key, size)
+
+        with self.lock:
+            self._evict()
+        return ok
+
+    def _set_clean_size(self, entry_key, size):
+        self.clean_bytes -= self.sizes.pop(entry_key, 0)
+        if size is not None:
+            self.sizes[entry_key] = size
+            self.clean_bytes += size
+
+    def _evict(self):
+        if self.clean_bytes <= self.max_clean_bytes:
+            return
+        for entry_key in list(self.entries):
+            if self.clean_bytes <= self.max_clean_bytes:
+                break
+            if entry_key in self.dirty or entry_key not in self.sizes:
+                continue
+            del self.entries[entry_key]
+            self._set_clean_size(entry_key, None)
+
+    def _start_writer(self):
+        if self.writer is None:
+            self.writer = threading.Thread(target=self._write_behind, daemon=True)
+            self.writer.start()
+        self.wake.set()
+
+    def _write_behind(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            # Let more writes pile up so they go out as one batch
+            time.sleep(self.flush_interval + self.retry_delay)
+            try:
+                ok = self.flush()
+            except Exception as e:
+                # Never let the writer die, nothing would be saved until exit
+                print("Error in write-behind thread:", e)
+                ok = False
+            if ok:
+                self.retry_delay = 0
+            else:
+                # Retry the failed keys on our own, backing off while the disk keeps failing
+                self.retry_delay = min(max(self.retry_delay * 2, 1), 60)
+                self.wake.set()
+
+
+data_store = DataStore()
+atexit.register(data_store.flush)
@@ -0,0 +1,133 @@
+import numpy as np
+
+try:
+    from rapidfuzz import fuzz as rapid_fuzz, process as rapid_process
+except ImportError:
+    rapid_process = None
+
+WORD_BITS = 64
+
+def _encode(strings):
+    """Packs strings into an (n, max_len) array of code points, padded with -1."""
+    max_len = max((len(s) for s in strings), default=0)
+    codes = np.full((len(strings), max(max_len, 1)), -1, dtype=np.int32)
+    for i, s in enumerate(strings):
+        if s:
+            codes[i, :len(s)] = np.frombuffer(s.encode("utf-32-le"), dtype=np.int32)
+    lengths = np.fromiter((len(s) for s in strings), dtype=np.int64, count=len(strings))
+    return codes, lengths
+
+def _lcs_lengths(query, codes):
+    """
+    Length of the longest common subsequence between query and every candidate, computed for
+    all candidates at once with the bit-parallel algorithm (Hyyrö), 64 query chars per word.
+    """
+    n = codes.shape[0]
+    m = len(query)
+    words = (m + WORD_BITS - 1) // WORD_BITS
+
+    # Bit mask of the query positions holding each distinct character, one extra all-zero row
+    # for characters that are not in the query (and for padding)
+    alphabet = np.array(sorted({ord(c) for c in query}), dtype=np.int32)
+    masks = np.zeros((alphabet.size + 1, words), dtype=np.uint64)
+    for position, char in enumerate(query):
+        row = np.searchsorted(alphabet, ord(char))
+        masks[row, position // WORD_BITS] |= np.uint64(1) << np.uint64(position % WORD_BITS)
+
+    # Code point -> mask row lookup table, padding (-1) lands on the last entry
+    max_code = max(int(codes.max()), int(alphabet.max()) if alphabet.size else 0)
+    lookup = np.full(max_code + 2, alphabet.size, dtype=np.int32)
+    lookup[alphabet] = np.arange(alphabet.size, dtype=np.int32)
+    # Column major so each step reads one contiguous row
+    rows = lookup[codes.T]
+
+    V = np.full((words, n), np.iinfo(np.uint64).max, dtype=np.uint64)
+    if words == 1:
+        # Common case (queries up to 64 chars), no carries between words
+        word_masks = masks[:, 0]
+        v = V[0]
+        u = np.empty(n, dtype=np.uint64)
+        for column_rows in rows:
+            np.bitwise_and(v, word_masks[column_rows], out=u)
+            np.bitwise_or(v + u, v - u, out=v)
+    else:
+        for column_rows in rows:
+            M = masks[column_rows].T
+            carry = np.zeros(n, dtype=np.uint64)
+            for word in range(words):
+                v = V[word]
+                u = v & M[word]
+                total = v + u
+                next_carry = (total < v).astype(np.uint64)
+                total = total + carry
+                next_carry |= (total < carry).astype(np.uint64)
+                V[word] = total | (v - u)
+                carry = next_carry
+
+    unmatched = np.zeros(n, dtype=np.int64)
+    for word in range(words):
+        bits = min(WORD_BITS, m - word * WORD_BITS)
+        mask = np.uint64((1 << bits) - 1) if bits < WORD_BITS else np.iinfo(np.uint64).max
+        unmatched += np.bitwise_count(V[word] & mask).astype(np.int64)
+    return m - unmatched
+
+
+class FuzzyMatcher:
+    """
+    Scores a query against a fixed list of candidate strings in one batch.
+
+    Scores are the same 0-100 ratio as fuzz.ratio (2 * matching chars / total chars). The
+    candidates are normalized and encoded once, so repeated queries only pay for the kernel:
+    rapidfuzz's C implementation if it is installed, otherwise a NumPy bit-parallel LCS.
+    """
+
+    def __init__(self, candidates, normalize=str.lower):
+        self.normalize = normalize
+        self.candidates = [normalize(candidate) for candidate in candidates]
+        self.codes = None
+        self.lengths = None
+        self.empty = None
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def scores(self, query):
+        query = self.normalize(query)
+        if len(self.candidates) == 0 or len(query) == 0:
+            return np.zeros(len(self.candidates), dtype=np.int64)
+
+        if rapid_process is not None:
+            scores = rapid_process.cdist([query], self.candidates, scorer=rapid_fuzz.ratio, workers=-1)[0]
+            scores = np.rint(scores).astype(np.int64)
+        else:
+            if self.codes is None:
+                self.codes, self.lengths = _encode(self.candidates)
+            lcs = _lcs_lengths(query, self.codes)
+            scores = np.rint(200 * lcs / (self.lengths + len(query))).astype(np.int64)
+
+        # fuzz.ratio scores empty strings as 0
+        if self.empty is None:
+            self.empty = np.array([len(candidate) == 0 for candidate in self.candidates], dtype=bool)
+        scores[self.empty] = 0
+        return scores
+
+    def top_k(self, query, k, scores=None):
+        """Returns [(score, index), ...] for the k best candidates, best first, ties in candidate order."""
+        if scores is None:
+            scores = self.scores(query)
+        return top_k(scores, k)
+
+
+def top_k(scores, k):
+    n = scores.size
+    if k <= 0 or n == 0:
+        return []
+    if k >= n:
+        order = np.argsort(-scores, kind="stable")
+    else:
+        kth = np.partition(scores, n - k)[n - k]
+        above = np.flatnonzero(scores > kth)
+        equal = np.flatnonzero(scores == kth)[:k - above.size]
+        order = np.concatenate([above, equal])
+        order = order[np.lexsort((order, -scores[order]))]
+    return [(int(scores[i]), int(i)) for i in order]
@@ -0,0 +1,195 @@
+import asyncio
+import itertools
+import json
+
+import websockets
+
+RECONNECT_DELAYS = [1, 2, 5, 10, 30]
+
+REGISTRY_COMMANDS = {
+    "area_registry_updated": "config/area_registry/list",
+    "device_registry_updated": "config/device_registry/list",
+    "entity_registry_updated": "config/entity_registry/list",
+}
+
+def websocket_url(hass_url):
+    url = hass_url.rstrip("/")
+    if not url.endswith("/api"):
+        url += "/api"
+    if url.startswith("https://"):
+        url = "wss://" + url[len("https://"):]
+    elif url.startswith("http://"):
+        url = "ws://" + url[len("http://"):]
+    return url + "/websocket"
+
+
+class HomeRegistry:
+    """
+    In-memory copy of a Home Assistant instance's entity states and area/device/entity registries.
+
+    The whole thing is fetched once over the websocket API, then kept fresh from state_changed
+    and *_registry_updated events on the same connection. Entity -> area and group membership
+    are precomputed, so finding the devices in a room never touches the network.
+    """
+
+    def __init__(self, hass_url, hass_token):
+        self.hass_url = hass_url
+        self.hass_token = hass_token
+
+        self.states = {}
+        self.areas = {}
+        self.devices = {}
+        self.entities = {}
+
+        # Derived from the above by _rebuild
+        self.group_members = {}
+        self.grouped = set()
+        self.entity_areas = {}
+        self.by_area = {}
+
+        self.ready = asyncio.Event()
+        self.task = None
+        self.ids = itertools.count(1)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def wait_ready(self, timeout=10):
+        self.start()
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def run(self):
+        attempt = 0
+        while True:
+            try:
+                async with websockets.connect(websocket_url(self.hass_url), max_size=None) as ws:
+                    attempt = 0
+                    await self.sync(ws)
+            except (OSError, websockets.WebSocketException, asyncio.TimeoutError, ValueError, KeyError) as e:
+                print("Home Assistant websocket error:", e)
+            # Data from before the disconnect is stale, but still better than nothing for a few seconds
+            delay = RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)]
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def send(self, ws, message):
+        message["id"] = next(self.ids)
+        await ws.send(json.dumps(message))
+        return message["id"]
+
+    async def sync(self, ws):
+        message = json.loads(await ws.recv())
+        if message["type"] == "auth_required":
+            await ws.send(json.dumps({"type": "auth", "access_token": self.hass_token}))
+            message = json.loads(await ws.recv())
+        if message["type"] != "auth_ok":
+            raise ValueError(f"Home Assistant auth failed: {message.get('message', message['type'])}")
+
+        # Subscribe before fetching so nothing that changes in between is missed
+        await self.send(ws, {"type": "subscribe_events", "event_type": "state_changed"})
+        for event_type in REGISTRY_COMMANDS:
+            await self.send(ws, {"type": "subscribe_events", "event_type": event_type})
+
+        pending = {await self.send(ws, {"type": "get_states"}): "get_states"}
+        for command in REGISTRY_COMMANDS.values():
+            pending[await self.send(ws, {"type": command})] = command
+        waiting_for = set(pending.values())
+
+        async for raw in ws:
+            message = json.loads(raw)
+            if message["type"] == "result":
+                command = pending.pop(message["id"], None)
+                if command is None:
+                    continue
+                if not message.get("success"):
+                    print("Home Assistant command failed:", command, message.get("error"))
+                    continue
+                self.apply_result(command, message["result"])
+                waiting_for.discard(command)
+                if not waiting_for:
+                    self.ready.set()
+            elif message["type"] == "event":
+                event = message["event"]
+                if event["event_type"] == "state_changed":
+                    self.apply_state(event["data"]["entity_id"], event["data"].get("new_state"))
+                elif event["event_type"] in REGISTRY_COMMANDS:
+                    command = REGISTRY_COMMANDS[event["event_type"]]
+                    pending[await self.send(ws, {"type": command})] = command
+
+    def apply_result(self, command, result):
+        if command == "get_states":
+            self.states = {state["entity_id"]: state for state in result}
+            self.group_members = {
+                entity_id: set(state["attributes"]["entity_id"])
+                for entity_id, state in self.states.items()
+                if isinstance(state["attributes"].get("entity_id"), list)
+            }
+        elif command == "config/area_registry/list":
+            self.areas = {area["area_id"]: area["name"] for area in result}
+        elif command == "config/device_registry/list":
+            self.devices = {device["id"]: device.get("area_id") for device in result}
+        elif command == "config/entity_registry/list":
+            self.entities = {entity["entity_id"]: (entity.get("area_id"), entity.get("device_id")) for entity in result}
+        self._rebuild()
+
+    def apply_state(self, entity_id, new_state):
+        old_state = self.states.get(entity_id)
+        if new_state is None:
+            self.states.pop(entity_id, None)
+        else:
+            self.states[entity_id] = new_state
+
+        old_members = self.group_members.get(entity_id)
+        members = new_state["attributes"].get("entity_id") if new_state is not None else None
+        members = set(members) if isinstance(members, list) else None
+        if members != old_members or (old_state is None) != (new_state is None):
+            if members is None:
+                self.group_members.pop(entity_id, None)
+            else:
+                self.group_members[entity_id] = members
+            self._rebuild()
+
+    def area_of(self, entity_id):
+        area_id, device_id = self.entities.get(entity_id, (None, None))
+        if area_id is None and device_id is not None:
+            area_id = self.devices.get(device_id)
+        return self.areas.get(area_id, "None")
+
+    def _rebuild(self):
+        self.grouped = set()
+        for group_id, members in self.group_members.items():
+            if group_id in self.states:
+                self.grouped.update(member for member in members if member in self.states)
+
+        self.entity_areas = {}
+        self.by_area = {}
+        for entity_id in self.states:
+            if entity_id in self.grouped:
+                continue
+            area = self.area_of(entity_id)
+            self.entity_areas[entity_id] = area
+            if area != "None":
+                self.by_area.setdefault(area.lower(), []).append(entity_id)
+
+    def devices_in_area(self, area):
+        return self.by_area.get(area.lower(), [])
+
+    def area_names(self):
+        return list(set(self.entity_areas.values()))
+
+
+# One registry (and websocket) per Home Assistant instance and token, shared by sessions
+_registries = {}
+
+def get_registry(hass_url, hass_token):
+    key = (hass_url, hass_token)
+    if key not in _registries:
+        _registries[key] = HomeRegistry(hass_url, hass_token)
+    registry = _registries[key]
+    registry.start()
+    return registry
@@ -0,0 +1,69 @@
+import time
+
+import httpx
+
+DEFAULT_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+DEFAULT_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0)
+# Connection attempts retried by the transport. Only failures to connect are retried, a request
+# that reached the server is never sent twice.
+CONNECT_RETRIES = 2
+
+class StatsTransport(httpx.AsyncHTTPTransport):
+    """AsyncHTTPTransport that counts what goes through it, for pool_stats."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_seconds = 0.0
+
+    async def handle_async_request(self, request):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        start = time.monotonic()
+        try:
+            return await super().handle_async_request(request)
+        except httpx.HTTPError:
+            self.errors += 1
+            raise
+        finally:
+            # Time until the response headers arrived
+            self.total_seconds += time.monotonic() - start
+            self.in_flight -= 1
+
+    def stats(self):
+        connections = self._pool.connections
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "avg_latency_ms": 1000 * self.total_seconds / self.requests if self.requests else 0.0,
+            "connections": len(connections),
+            "idle_connections": sum(1 for connection in connections if connection.is_idle()),
+        }
+
+# One client (so one keep-alive connection pool) per base URL, shared by every user.
+# get_client("") is the client for arbitrary URLs.
+_clients = {}
+
+def get_client(base_url):
+    client = _clients.get(base_url)
+    if client is None or client.is_closed:
+        transport = StatsTransport(limits=DEFAULT_LIMITS, retries=CONNECT_RETRIES)
+        client = httpx.AsyncClient(base_url=base_url, timeout=DEFAULT_TIMEOUT, transport=transport)
+        client.stats_transport = transport
+        _clients[base_url] = client
+    return client
+
+def pool_stats():
+    return {base_url or "*": client.stats_transport.stats() for base_url, client in _clients.items()}
+
+async def close_clients():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
@@ -1,7 +1,12 @@
-import requests
+import asyncio
+import httpx
 import json
 
-from .lucy_module import LucyModule, available_for_lucy
+from .lucy_module import LucyModule, available_for_lucy, callable_by_lucy
+from .home_registry import get_registry
+from .http_pool import get_client
+
+GET_RETRIES = 1
 
 # TURNING ON LIGHTS AND SETTING COLOR SHOULD BE DIFFERENT FUNCTIONS
 # REPLACE GET_DEVICE_TYPE WITH GET_DEVICES_IN_ROOM
@@ -13,7 +18,7 @@ class LHome(LucyModule):
         super().__init__("home")
         
 
-    def setup(self):
+    async def setup(self):
         data = self.load_data("homeassistant", {
             "hass_url": "",
             "hass_token": "",
@@ -21,35 +26,26 @@ class LHome(LucyModule):
         self.HASS_URL = data["hass_url"]
         self.HASS_TOKEN = data["hass_token"]
 
-    def _make_request(self, endpoint, data=None):
-        url = self.HASS_URL + endpoint
+        # Start loading the device registry now so it's ready by the first question
+        if self.HASS_URL != "" and self.HASS_TOKEN != "":
+            get_registry(self.HASS_URL, self.HASS_TOKEN)
+
+    async def _make_request(self, endpoint, data=None):
+        # Pooled per Home Assistant URL, so users of the same instance share keep-alive connections
+        client = get_client(self.HASS_URL)
         headers = {
             "Authorization": f"Bearer {self.HASS_TOKEN}"
         }
-        if data is None:
-            response = requests.get(url, headers=headers)
-        else:
-            response = requests.post(url, headers=headers, json=data)
-
-        return response
+        for attempt in range(GET_RETRIES + 1):
+            try:
+                if data is None:
+                    return await client.get(endpoint, headers=headers)
+                return await client.post(endpoint, headers=headers, json=data)
+            except httpx.TimeoutException:
+                # A timed out POST may still have been carried out, only reads are repeated
+                if data is not None or attempt == GET_RETRIES:
+                    raise
     
-    def _get_device_areas(self, device_ids):
-        template = "{{ "
-        for device_id in device_ids:
-            template += f"area_name('{device_id}'), "
-        template = template[:-2] + " }}"
-
-        response = self._make_request("/template", {"template": template}).text[1:-1].split(", ")
-
-        device_area_map = {}
-        for device_id, area_name in zip(device_ids, response):
-            area_name = area_name[1:-1]
-            if area_name == "on":
-                area_name = "None"
-            device_area_map[device_id] = area_name
-
-        return device_area_map
-
     # def get_area_ids(self):
     #     endpoint = "/template"
     #     data = {
@@ -70,49 +66,27 @@ class LHome(LucyModule):
         if self.HASS_TOKEN == "" or self.HASS_URL == "":
             return "Home Assistant URL or token is not set. Ask the user to set it by modifying the configuration file."
         
-        endpoint = "/states"
-        response = self._make_request(endpoint).json()
-        
-        # Reformat as a dictionary for easier access
-        devices = {}
-        for device in response:
-            devices[device["entity_id"]] = device
-
-        # Remove devices that are in groups
-        for device_id in list(devices.keys()):
-            if device_id not in devices:
-                continue
-            if "entity_id" in devices[device_id]["attributes"]:
-                group_devices = devices[device_id]["attributes"]["entity_id"]
-                for group_device in group_devices:
-                    if group_device in devices:
-                        del devices[group_device]
-        
-        # Get device areas
-        device_ids = list(devices.keys())
-        device_areas = self._get_device_areas(device_ids)
-
-        # Filter devices with no area
-        for device_id in list(devices.keys()):
-            if device_areas[device_id] == "None":
-                del devices[device_id]
-            if room == "all":
-                continue
-            if room == "default":
-                room = "garage"
-            if device_areas[device_id].lower() != room.lower():
-                if device_id in devices:
-                    del devices[device_id]
-
-        if len(devices) == 0:
-            return {"error": f"Room '{room}' does not exist", "valid_rooms": list(set(device_areas.values()))}
+        # Answered from the in-memory registry, kept up to date over the websocket API
+        registry = get_registry(self.HASS_URL, self.HASS_TOKEN)
+        if not await registry.wait_ready():
+            return {"error": "Could not connect to Home Assistant."}
+
+        if room == "default":
+            room = "garage"
+        if room == "all":
+            device_ids = [device_id for device_id, area in registry.entity_areas.items() if area != "None"]
+        else:
+            device_ids = registry.devices_in_area(room)
+
+        if len(device_ids) == 0:
+            return {"error": f"Room '{room}' does not exist", "valid_rooms": registry.area_names()}
 
         output = []
-        for device_id, device in devices.items():
-            area = device_areas[device_id]
+        for device_id in device_ids:
+            device = registry.states[device_id]
             output.append({
                 "id": f"home:device:{device_id}",
-                "room": area,
+                "room": registry.entity_areas[device_id],
                 "name": device["attributes"].get("friendly_name", device_id),
                 "type": device["entity_id"].split(".")[0],
                 "state": device["state"],
@@ -120,8 +94,8 @@ class LHome(LucyModule):
 
         return {"devices": output}
     
-    def _dump_device_functions(self, device_type):
-        services = self._make_request("/services").json()
+    async def _dump_device_functions(self, device_type):
+        services = (await self._make_request("/services")).json()
         for service in services:
             if service["domain"] == device_type:
                 services = service
@@ -149,6 +123,7 @@ class LHome(LucyModule):
 
         return {"functions": functions}
     
+    @callable_by_lucy
     async def set_lights(self, device_ids: list, brightness_pct: int = None, color_name: str = None):
         """Sets the brightness percentage (0-100) and/or the color name (e.g., 'red', 'blue', 'default') of a list of light devices. You can optionally specify either brightness_pct or color_name or both."""
         if brightness_pct is None and color_name is None:
@@ -159,34 +134,48 @@ class LHome(LucyModule):
         if color_name is not None:
             data["color_name"] = color_name
 
-        for device_id in device_ids:
-            response = self._trigger(device_id, "turn_on", **data)
-        return {"status": "success"}
+        return await self._call_service(device_ids, "turn_on", **data)
 
+    @callable_by_lucy
     async def turn_on_lights(self, device_ids: list):
         """Turns on a list of light devices."""
-        for device_id in device_ids:
-            response = self._trigger(device_id, "turn_on")
-        return {"status": "success"}
+        return await self._call_service(device_ids, "turn_on")
 
+    @callable_by_lucy
     async def turn_off_lights(self, device_ids: list):
         """Turns off a list of light devices."""
+        return await self._call_service(device_ids, "turn_off")
+
+    async def _call_service(self, device_ids, service, **data):
+        """
+        Calls service with the same data on all the devices: one call per domain with every
+        entity of that domain in it, the domains concurrently.
+        """
+        by_domain = {}
         for device_id in device_ids:
-            response = self._trigger(device_id, "turn_off")
-        return {"status": "success"}
-
-    def _trigger(self, device_id, trigger_name, **kwargs):
-        device_type = device_id.split(":")[2].split(".")[0]
-        # endpoint = f"/services/{device_type}/{trigger_name}?return_response=true"
-        endpoint = f"/services/{device_type}/{trigger_name}"
-        data = {
-            "entity_id": device_id.split(":")[2],
-            **kwargs
-        }
-        response = self._make_request(endpoint, data)
-        print("Request to", endpoint, "with data", data)
-        print(response.text)
-        return response.text
+            entity_id = device_id.split(":")[2]
+            by_domain.setdefault(entity_id.split(".")[0], []).append(entity_id)
+
+        async def call(domain, entity_ids):
+            endpoint = f"/services/{domain}/{service}"
+            try:
+                response = await self._make_request(endpoint, {"entity_id": entity_ids, **data})
+            except httpx.HTTPError as e:
+                return {entity_id: f"error: {e}" for entity_id in entity_ids}
+            print("Request to", endpoint, "for", len(entity_ids), "entities:", response.status_code)
+            if response.status_code != 200:
+                return {entity_id: f"error: {response.status_code} {response.text[:200]}" for entity_id in entity_ids}
+            return {entity_id: "ok" for entity_id in entity_ids}
+
+        results = {}
+        for domain_results in await asyncio.gather(*[call(domain, entity_ids) for domain, entity_ids in by_domain.items()]):
+            for entity_id, result in domain_results.items():
+                results[f"home:device:{entity_id}"] = result
+
+        failed = [device_id for device_id, result in results.items() if result != "ok"]
+        if len(failed) == 0:
+            return {"status": "success"}
+        return {"status": "partial_failure" if len(failed) < len(results) else "failure", "results": results}
     
 # if __name__ == "__main__":
 #     import asyncio
@@ -1,21 +1,22 @@
 from .lucy_module import LucyModule, available_for_lucy
+from .manifest import get_tool_documentation
 
-from .lspotify import LSpotify
-from .ltime import LTime
-from .lclock import LClock
-from .lhome import LHome
-from .linternet import LInternet
+import asyncio
+import importlib
+import inspect
 # from tools.lappletv import LAppleTV
 
 class LInternal(LucyModule):
 
+    # Tool modules are only imported the first time they are needed (see get_tool_class)
     tool_classes = {
-        "spotify": LSpotify,
-        "time": LTime,
-        "home": LHome,
-        "clock": LClock,
-        "internet": LInternet,
+        "spotify": "lspotify.LSpotify",
+        "time": "ltime.LTime",
+        "home": "lhome.LHome",
+        "clock": "lclock.LClock",
+        "internet": "linternet.LInternet",
     }
+    loaded_tool_classes = {}
     
     
     def __init__(self, user_id, websocket, session):
@@ -27,60 +28,93 @@ class LInternal(LucyModule):
         self.user_id = user_id
         
         self.tool_registry = {}
+        self.tool_setup_tasks = {}
         self.imported_tools = set()
 
         self.register_self()
 
-        for tool_name in self.tool_classes:
-            self.add_tool_sync(tool_name)
-
     def get_tool_registry(self):
         return self.tool_registry
     
     def register_self(self):
-        self.tool_registry[self.name] = self.get_callable_functions()
+        self.tool_registry[self.name] = self
         self.imported_tools.add(self.name)
 
     async def wake_word_identified(self):
-        for tool_name in self.tool_registry:
-            if tool_name == "internal":
+        for tool_name in list(self.tool_registry):
+            if tool_name == "internal" or not self.tool_is_ready(tool_name):
                 continue
-            kwargs = {
-                "self": self.tool_registry[tool_name]["module"]
-            }
-            await self.tool_registry[tool_name]["wake_word_identified"](**kwargs)
+            await self.tool_registry[tool_name].wake_word_identified()
 
     async def undo_wake_word_identified(self):
-        for tool_name in self.tool_registry:
-            if tool_name == "internal":
+        for tool_name in list(self.tool_registry):
+            if tool_name == "internal" or not self.tool_is_ready(tool_name):
                 continue
-            kwargs = {
-                "self": self.tool_registry[tool_name]["module"]
-            }
-            await self.tool_registry[tool_name]["undo_wake_word_identified"](**kwargs)
+            await self.tool_registry[tool_name].undo_wake_word_identified()
 
     @available_for_lucy
     async def add_tool(self, name):
-        self.imported_tools.add(name)
-        return self.tool_registry[name]["module"].build_documentation()
-    
-    def add_tool_sync(self, name):
-        print(f"Adding tool: {name}")
         if name not in LInternal.tool_classes:
             return f"Tool '{name}' is not available. Available tools: {', '.join(LInternal.tool_classes.keys())}"
+        await self.ensure_tool(name)
+        self.imported_tools.add(name)
+        return get_tool_documentation(name)
+
+    def get_tool(self, name):
+        """Creates the tool object the first time it is needed. Does not run setup."""
         if name not in self.tool_registry:
-            tool_obj = LInternal.tool_classes[name]()
+            print(f"Adding tool: {name}")
+            tool_obj = LInternal.get_tool_class(name)()
             tool_obj.set_websocket(self.websocket)
             tool_obj.set_user_id(self.user_id)
             tool_obj.set_session(self.session)
-            tool_obj.setup()
-            self.tool_registry[name] = tool_obj.get_callable_functions()
+            self.tool_registry[name] = tool_obj
+        return self.tool_registry[name]
 
-        tool_obj = self.tool_registry[name]["module"]
-        return tool_obj.build_documentation()
+    def start_tool_setup(self, name):
+        """Starts the tool's setup in the background (if it isn't already running) and returns the task."""
+        task = self.tool_setup_tasks.get(name)
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            tool_obj = self.get_tool(name)
+            if inspect.iscoroutinefunction(tool_obj.setup):
+                task = asyncio.create_task(tool_obj.setup())
+            else:
+                task = asyncio.create_task(asyncio.to_thread(tool_obj.setup))
+            self.tool_setup_tasks[name] = task
+        return task
+
+    async def ensure_tool(self, name):
+        """Returns the tool object once its setup has finished."""
+        if name == self.name:
+            return self.tool_registry[name]
+        # Shielded, the setup is shared and one caller giving up shouldn't cancel it for the others
+        await asyncio.shield(self.start_tool_setup(name))
+        return self.tool_registry[name]
+
+    def tool_is_ready(self, name):
+        if name == self.name:
+            return True
+        task = self.tool_setup_tasks.get(name)
+        return task is not None and task.done() and not task.cancelled() and task.exception() is None
     
+    def teardown(self):
+        """Stops every tool's background work, called when the session is removed."""
+        for name, task in self.tool_setup_tasks.items():
+            if not task.done():
+                task.cancel()
+            elif self.tool_is_ready(name):
+                self.tool_registry[name].teardown()
+        self.tool_setup_tasks = {}
+
     def tool_is_imported(self, name):
         return name in self.imported_tools
     
+    def get_tool_class(name):
+        if name not in LInternal.loaded_tool_classes:
+            module_name, class_name = LInternal.tool_classes[name].rsplit(".", 1)
+            module = importlib.import_module(f".{module_name}", __package__)
+            LInternal.loaded_tool_classes[name] = getattr(module, class_name)
+        return LInternal.loaded_tool_classes[name]
+
     def get_global_web_preview(module_name, path, args={}):
-        return LInternal.tool_classes[module_name].get_global_web_preview(path, args=args)
\ No newline at end of file
+        return LInternal.get_tool_class(module_name).get_global_web_preview(path, args=args)
\ No newline at end of file
@@ -1,14 +1,76 @@
 from .lucy_module import LucyModule, available_for_lucy
 
+from .http_pool import get_client
+
+import asyncio
+import hashlib
+import httpx
 import requests
 import json
+import os
 import re
 
-from bs4 import BeautifulSoup
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
 
 BASE = "https://api.search.brave.com/res/v1/web/search"
 USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.4 Safari/605.1.15"
 
+# Pages are read up to this many bytes, the rest is never downloaded
+MAX_PAGE_BYTES = 2 * 1024 * 1024
+PAGE_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+
+# Set to a directory to keep the extracted text of viewed pages for debugging
+PAGE_DUMP_DIR = os.environ.get("LUCYSERVER_PAGE_DUMP_DIR")
+MAX_DUMP_BYTES = 256 * 1024
+MAX_DUMP_DIR_BYTES = 32 * 1024 * 1024
+
+STRIPPED_TAGS = ['script', 'style', 'footer', 'nav', 'aside', 'header']
+
+def extract_text(html):
+    """The visible text of the page's <main> (or whole body), one line per text node."""
+    if lxml is not None:
+        try:
+            document = lxml.html.fromstring(html)
+        except (ValueError, lxml.etree.ParserError):
+            document = None
+        if document is not None:
+            for tag in list(document.iter(*STRIPPED_TAGS)):
+                tag.drop_tree()
+            main_content = document.find(".//main")
+            if main_content is not None:
+                document = main_content
+            return "\n".join(text.strip() for text in document.itertext() if text.strip())
+
+    from bs4 import BeautifulSoup
+
+    site_content = BeautifulSoup(html, "html.parser")
+    for tag in site_content(STRIPPED_TAGS):
+        tag.decompose()
+    main_content = site_content.find("main")
+    if main_content:
+        site_content = main_content
+    return site_content.get_text(separator="\n", strip=True)
+
+def dump_page(url, text):
+    """Writes the page text to PAGE_DUMP_DIR, dropping the oldest dumps once it gets too big."""
+    os.makedirs(PAGE_DUMP_DIR, exist_ok=True)
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", url.split("://", 1)[-1])[:80]
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+    with open(os.path.join(PAGE_DUMP_DIR, f"{name}_{digest}.txt"), "w") as f:
+        f.write(text[:MAX_DUMP_BYTES])
+
+    dumps = [entry for entry in os.scandir(PAGE_DUMP_DIR) if entry.name.endswith(".txt")]
+    dumps.sort(key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in dumps)
+    for entry in dumps[:-1]:
+        if total <= MAX_DUMP_DIR_BYTES:
+            break
+        total -= entry.stat().st_size
+        os.remove(entry.path)
+
 class LInternet(LucyModule):
     def __init__(self):
         super().__init__("internet")
@@ -45,25 +107,17 @@ class LInternet(LucyModule):
         headers = {
             "User-Agent": USER_AGENT
         }
-        site_data = requests.get(url, headers=headers)
-        if site_data.status_code != 200:
-            # return f"Error: {site_data.status_code} - {site_data.text}"
-            return {"error": f"Failed to fetch page: {site_data.status_code}"}
-        site_content = site_data.text
+        try:
+            html = await self._fetch_page(url, headers)
+        except httpx.HTTPError as e:
+            return {"error": f"Failed to fetch page: {e}"}
+        if isinstance(html, dict):
+            return html
 
-        site_content = BeautifulSoup(site_content, "html.parser")
-
-        for tag in site_content(['script', 'style', 'footer', 'nav', 'aside', 'header']):
-            tag.decompose()
-
-        main_content = site_content.find("main")
-        if main_content:
-            site_content = main_content
-        
-        site_content = site_content.get_text(separator="\n", strip=True)
-        # write out the content to a file for debugging
-        with open(f"{url.replace('https://', '').replace('http://', '').replace('/', '_')}.txt", "w") as f:
-            f.write(site_content)
+        # Parsing a big page takes a while, keep it off the event loop
+        site_content = await asyncio.to_thread(extract_text, html)
+        if PAGE_DUMP_DIR:
+            await asyncio.to_thread(dump_page, url, site_content)
 
 
         if question is None:
@@ -74,19 +128,33 @@ class LInternet(LucyModule):
 
 
         prompt = f"# Page Contents\n{site_content}\n\n# Question\n{question}\n\n"
-        completion = self.session.get_openai_client().chat.completions.create(
-            model=self.session.MODEL_NAME,
-            messages=[
-                {"role": "system", "content": "You extract answers to questions from web pages. Do not reply in complete sentences, instead just return the answer and a quote from the page."},
-                {"role": "user", "content": prompt}
-            ]
-        )
+        completion = await self.session.create_completion([
+            {"role": "system", "content": "You extract answers to questions from web pages. Do not reply in complete sentences, instead just return the answer and a quote from the page."},
+            {"role": "user", "content": prompt}
+        ])
         output = completion.choices[0].message.content
         return {"extracted_answer": output, "source": url, "note": "Remember to reiterate the answer for the user."}
 
+    async def _fetch_page(self, url, headers):
+        """Streams the page, stopping after MAX_PAGE_BYTES. Returns the html, or an error dict."""
+        async with get_client("").stream("GET", url, headers=headers, follow_redirects=True, timeout=PAGE_TIMEOUT) as response:
+            if response.status_code != 200:
+                return {"error": f"Failed to fetch page: {response.status_code}"}
+            content_type = response.headers.get("Content-Type", "text/html")
+            if "html" not in content_type and not content_type.startswith("text/"):
+                return {"error": f"Page is not HTML: {content_type}"}
+
+            chunks = []
+            size = 0
+            async for chunk in response.aiter_bytes():
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= MAX_PAGE_BYTES:
+                    print(f"Page {url} is over {MAX_PAGE_BYTES} bytes, only reading the start")
+                    break
+            return b"".join(chunks)[:MAX_PAGE_BYTES].decode(response.encoding or "utf-8", errors="replace")
 
-if __name__ == "__main__":
-    import asyncio
 
+if __name__ == "__main__":
     internet_tool = LInternet()
     # print(asyncio.run(internet_tool.search("raspberry pi 5 power draw")))
\ No newline at end of file
@@ -1,71 +1,106 @@
 from .lucy_module import LucyModule, available_for_lucy
+from .fuzzy import FuzzyMatcher
+from .spotify_catalog import SpotifyCatalog, clean_name
 
-from spotipy import Spotify
-from spotipy.exceptions import SpotifyException
-from spotipy.oauth2 import SpotifyOAuth
-from fuzzywuzzy import fuzz
+from .spotify_client import SpotifyClient, SpotifyError, request_token
+from .spotify_sync import LibrarySync, slim_track
+from .token_refresh import refresh_scheduler
 from importlib import resources
 
 import asyncio
+import inspect
+import numpy as np
 import os
-import json
-import re
-import requests
-import base64
 import time
 
 REDIRECT_URL = "http://127.0.0.1:8000/v1/module/spotify/callback"
 SCOPE = "user-read-playback-state user-modify-playback-state user-read-currently-playing user-library-read user-library-modify"
 
+# How long to wait for the client's web player to report it is ready
+PLAYER_READY_TIMEOUT = 5
+
+# How long reads are served from the read cache, by client method
+READ_CACHE_TTL = {
+    "current_playback": 3,
+    "playlist_items": 60,
+    "search": 5 * 60,
+}
+READ_CACHE_MAX_ENTRIES = 256
+
+# Calls that change playback state and so invalidate the cached current_playback
+WRITE_FUNCTIONS = {
+    "start_playback", "pause_playback", "next_track", "previous_track", "shuffle",
+    "add_to_queue", "current_user_saved_tracks_add",
+}
+
+# Fuzzy score a local catalog match needs to be played without searching Spotify
+LOCAL_MATCH_SCORE = 90
+
 class LSpotify(LucyModule):
     def __init__(self):
         super().__init__("spotify")
     
 
-    def refresh_tokens(self):
-        # STUB - WILL REFRESH TOKENS IN A SEC - WILL SET self.is_logged_in
+    async def refresh_tokens(self):
+        # WILL SET self.is_logged_in
         if "refresh_token" not in self.tokens:
             self.is_logged_in = False
             return
         
         refresh_token = self.tokens["refresh_token"]
-        url = "https://accounts.spotify.com/api/token"
         form_data = {
             "grant_type": "refresh_token",
             "refresh_token": refresh_token,
             "client_id": self.CLIENT_ID
         }
-        authorization = self.CLIENT_ID + ":" + self.CLIENT_SECRET 
-        authorization = base64.b64encode(authorization.encode("ascii")).decode("ascii")
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Authorization": "Basic " + authorization
-        }
-        response = requests.post(url, data=form_data, headers=headers)
-        if response.status_code != 200:
-            print("Error refreshing tokens:", response.status_code, response.text)
+        status, new_tokens = await request_token(self.CLIENT_ID, self.CLIENT_SECRET, form_data)
+        if status != 200:
+            print("Error refreshing tokens:", status, new_tokens)
+            if (status == 0 or status >= 500) and self.tokens.get("expires_in", 0) > int(time.time()):
+                # Spotify is unreachable, the current token still works until it expires
+                return {"error": "Error refreshing tokens"}
             self.is_logged_in = False
+            refresh_scheduler.unschedule(self)
             return {"error": "Error refreshing tokens"}
-        new_tokens = response.json()
         new_tokens["refresh_token"] = refresh_token 
-        self.set_tokens(new_tokens)
-
+        await self.set_tokens(new_tokens)
+
+    async def refresh_tokens_once(self):
+        """Runs refresh_tokens, or waits for the one already running."""
+        if self.refresh_task is None:
+            self.refresh_task = asyncio.ensure_future(self.refresh_tokens())
+            self.refresh_task.add_done_callback(lambda _: setattr(self, "refresh_task", None))
+        return await asyncio.shield(self.refresh_task)
+
+    async def scheduled_refresh(self):
+        """Called by the refresh scheduler a few minutes before the token expires."""
+        if self.closed:
+            return False
+        response = await self.refresh_tokens_once()
+        return response is None and self.is_logged_in
+
+    async def get_access_token(self):
+        """Token provider for the SpotifyClient. The scheduler normally refreshes well before this has to."""
+        if self.tokens.get("expires_in", 0) < int(time.time()) + 60:
+            await self.refresh_tokens_once()
+        if self.is_logged_in == False:
+            raise SpotifyError(401, "Not logged in to Spotify.")
+        return self.tokens["access_token"]
 
-    def set_tokens(self, tokens):
+    async def set_tokens(self, tokens):
         tokens["expires_in"] = tokens["expires_in"] + int(time.time())
         self.tokens = tokens
         self.save_data("tokens", tokens)
         self.is_logged_in = True
+        if self.closed:
+            # A refresh that finished after teardown, keep the tokens but don't start anything again
+            return
+        refresh_scheduler.schedule(self, tokens["expires_in"])
 
-        self.sp = Spotify(auth=self.tokens["access_token"])
-        
-        self.liked_songs = LikedSongs(self.sp, self.save_data, self.load_data)
-        self.liked_songs.update_liked_songs_cache()
-
-        self.user_playlists = UserPlaylists(self.sp, self.save_data, self.load_data)
-        self.user_playlists.update_user_playlists_cache()
+        # The library is synced in the background from here on, not on every token refresh
+        self.library_sync.start()
 
-    def setup(self):
+    async def setup(self):
         data = self.load_data("spotify_api", {
             "client_id": "",
             "client_secret": "",
@@ -74,70 +109,130 @@ class LSpotify(LucyModule):
         self.CLIENT_SECRET = data["client_secret"]
 
         self.is_logged_in = False
-        self.sp = None
+        self.closed = False
+        self.refresh_task = None
+        self.sp = SpotifyClient(self.get_access_token)
         self.tokens = self.load_data("tokens", {})
 
-        self.refresh_tokens()
+        self.liked_songs = LikedSongs(self.save_data_items, self.load_data)
+        self.user_playlists = UserPlaylists(self.save_data_items, self.load_data)
+        self.catalog = SpotifyCatalog(self.liked_songs, self.save_data_items, self.load_data)
+        self.library_sync = LibrarySync(self.sp, self.liked_songs, self.user_playlists, self.catalog)
 
-        self.player_is_loaded = False
-        
+        # Web player state for this connection, set when the client reports the player is ready
+        self.player_ready = asyncio.Event()
+        self.player_init_sent = False
+        self.device_id = None
+
+        # (function name, args) -> (expires at, task), see _cached_spotify_function
+        self.read_cache = {}
+
+        # Background queueing of album/artist tracks after the first one
+        self.queue_task = None
+        self.queue_errors = []
+
+        await self.refresh_tokens()
 
-    async def _wrapped_spotify_function(self, func, tries=0, **kwargs):
+    async def init_player(self):
+        """Asks the client to load the web player, unless it is loaded or already loading."""
+        if self.player_ready.is_set() or self.player_init_sent:
+            return
+        self.player_init_sent = True
+        await self.send_socket_message({"message": "INIT_SPOTIFY_STREAMING"})
+
+    async def wait_for_player(self, reload=False):
+        if reload:
+            self.player_ready.clear()
+            self.player_init_sent = False
+        await self.init_player()
+        try:
+            await asyncio.wait_for(self.player_ready.wait(), timeout=PLAYER_READY_TIMEOUT)
+            return True
+        except asyncio.TimeoutError:
+            self.player_init_sent = False
+            return False
+
+    def teardown(self):
+        self.closed = True
+        self.library_sync.stop()
+        refresh_scheduler.unschedule(self)
+        for task in (self.queue_task, self.refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+
+    async def wake_word_identified(self):
+        # Start loading the web player while the user is still talking
+        if self.is_logged_in:
+            await self.init_player()
+
+    async def _wrapped_spotify_function(self, func, tries=0, reloaded=False, **kwargs):
         if self.is_logged_in == False:
             return {"error": "Not logged in to Spotify."}
-        
-        if self.tokens["expires_in"] < int(time.time()) + 60:
-            self.refresh_tokens()
-            if self.is_logged_in == False:
-                return {"error": "Not logged in to Spotify."}
             
         try:
-            response = func(**kwargs)
+            response = await func(**kwargs)
+            if func.__name__ in WRITE_FUNCTIONS:
+                # Anything we change can show up in the playback state
+                self.read_cache.pop(("current_playback", ()), None)
             return response
-        except SpotifyException as e:
-            if e.reason == "NO_ACTIVE_DEVICE":
-                if tries == 1:
+        except SpotifyError as e:
+            targeted = kwargs.get("device_id") is not None
+            if e.reason == "NO_ACTIVE_DEVICE" or (targeted and e.status == 404):
+                if tries == 3:
                     return {"error": "An error occured starting playback"}
-                
-                self.player_is_loaded = False
-                await self.send_socket_message({"message": "INIT_SPOTIFY_STREAMING"})
 
-                timeout = 0 # MAX IS 5 SECONDS
-                while not self.player_is_loaded and timeout < 5:
-                    await asyncio.sleep(0.1) # Wait for incoming websocket message to set player_is_loaded to True
-                    timeout += 0.1
-
-                # wait an extra 0.25 seconds to ensure player is ready
-                await asyncio.sleep(0.25)
-
-                if not self.player_is_loaded:
+                if targeted and not reloaded:
+                    # The device we knew about is gone (player closed or went idle), load a new one
+                    kwargs.pop("device_id")
+                    self.device_id = None
+                    ready = await self.wait_for_player(reload=True)
+                    reloaded = True
+                elif targeted:
+                    # A 404 right after the player came up means Spotify hasn't registered the device yet
+                    ready = True
+                    await asyncio.sleep(0.1 * tries)
+                else:
+                    # Without a device id (or if using it didn't help) the only way to get an active
+                    # device is loading the player again
+                    reload = self.device_id is None or tries > 0
+                    ready = await self.wait_for_player(reload=reload)
+                    reloaded = reloaded or reload
+                if not ready:
                     return {"error": "An error occured starting playback"}
-                                
-                return await self._wrapped_spotify_function(func, tries=1, **kwargs)
+
+                # Send it straight to our player instead of whatever device was active last
+                if self.device_id is not None and "device_id" in inspect.signature(func).parameters:
+                    kwargs["device_id"] = self.device_id
+                return await self._wrapped_spotify_function(func, tries=tries + 1, reloaded=reloaded, **kwargs)
+            elif e.status == 401 and self.is_logged_in == False:
+                return {"error": "Not logged in to Spotify."}
             else:
                 print("SPOTIFY EXCEPTION", e, e.reason)
-                return {"error": f"An error occurred: {e}"}
+                return {"error": f"An error occurred: {e.message}"}
             
 
-    def clean_name(self, name):
-        # Remove text in parentheses
-        name = re.sub(r'\([^)]*\)', '', name)
+    async def _cached_spotify_function(self, func, **kwargs):
+        """
+        _wrapped_spotify_function for reads, with the result kept for READ_CACHE_TTL seconds.
+        Callers asking for the same thing while it is being fetched share the one request.
+        """
+        key = (func.__name__, tuple(sorted(kwargs.items())))
+        entry = self.read_cache.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if len(self.read_cache) > READ_CACHE_MAX_ENTRIES:
+                now = time.monotonic()
+                self.read_cache = {k: v for k, v in self.read_cache.items() if v[0] >= now}
+            task = asyncio.ensure_future(self._wrapped_spotify_function(func, **kwargs))
+            entry = (time.monotonic() + READ_CACHE_TTL[func.__name__], task)
+            self.read_cache[key] = entry
+
+        response = await asyncio.shield(entry[1])
+        if isinstance(response, dict) and "error" in response and self.read_cache.get(key) is entry:
+            del self.read_cache[key]
+        return response
 
-        # Replace & with 'and'
-        formatted_name = name.replace("&", "and")
-        
-        # Convert to lowercase
-        formatted_name = formatted_name.lower()
-        
-        # Remove non-alphanumeric characters except spaces
-        formatted_name = ''.join(e for e in formatted_name if e.isalnum() or e == ' ')
-        
-        # Remove extra spaces
-        formatted_name = formatted_name.split(" ")
-        formatted_name = [word for word in formatted_name if word != ""]
-        formatted_name = " ".join(formatted_name)
-        
-        return formatted_name
+    def clean_name(self, name):
+        return clean_name(name)
 
 
     def build_utterences(self, item_type, spotify_item):
@@ -206,7 +301,10 @@ class LSpotify(LucyModule):
 
             tracks = []
             # results = self.sp.playlist_items(best_playlist["id"], limit=20)
-            results = await self._wrapped_spotify_function(self.sp.playlist_items, playlist_id=best_playlist["id"], limit=20)
+            results = await self._cached_spotify_function(self.sp.playlist_items, playlist_id=best_playlist["id"], limit=20)
+            if "error" in results:
+                return results
+            self.catalog.add_items("track", [item["track"] for item in results["items"]])
             for item in results["items"]:
                 track = item["track"]
                 if track is None:
@@ -258,40 +356,26 @@ class LSpotify(LucyModule):
             if not should_queue:
                 await self._wrapped_spotify_function(func, uris=track_uris)
             else:
-                await self._wrapped_spotify_function(func, uri=found_track["uri"])
+                # Through the queue task, so it lands after any album still being queued
+                await self._queue_tracks(track_uris)
             return {"status": "playing", "item": f"{found_track['name']} (track) by {found_track['artists'][0]['name']}"}
         
-        # results = self.sp.search(q=string_query, type="track,album,artist", limit=10)
-        results = await self._wrapped_spotify_function(self.sp.search, q=string_query, type="track,album,artist", limit=10)
-        items = []
-        added = set()
-        for item_type in ["tracks", "albums", "artists"]:
-            if item_type in results:
-                for item in results[item_type]["items"]:
-                    if item == None:
-                        continue
-                    nat_lang_str = self.build_natrual_language_str(item_type[:-1], item).lower()
-                    if nat_lang_str in added:
-                        continue
-                    item_type_singular = item_type[:-1]
-                    items.append({"type": item_type_singular, "item": item, "utterence": self.build_utterences(item_type_singular, item)})
-                    added.add(self.build_natrual_language_str(item_type_singular, item).lower())
-
-        best_items = []
-        best_score = 0
-        for entry in items:
-            for utterence in entry["utterence"]:
-                score = fuzz.ratio(string_query.lower(), utterence.lower())
-                # boost score by 20 if in liked songs
-                if entry["type"] == "track":
-                    liked_songs = self.liked_songs.get_liked_songs_cache()
-                    if entry["item"]["uri"] in liked_songs:
-                        score += 20
-                if score > best_score:
-                    best_score = score
-                    best_items = [entry]
-                elif score == best_score:
-                    best_items.append(entry)
+        # Try the local catalog first, only a confident unambiguous match skips the remote search
+        local_items = self.build_items([(entry["type"], entry) for entry in self.catalog.search(string_query)])
+        best_items, best_score = self.score_items(string_query, local_items, liked_boost=False)
+        if best_score < LOCAL_MATCH_SCORE or len(best_items) != 1:
+            # results = self.sp.search(q=string_query, type="track,album,artist", limit=10)
+            results = await self._cached_spotify_function(self.sp.search, q=string_query, type="track,album,artist", limit=10)
+            if "error" in results:
+                return results
+            found = []
+            for item_type in ["tracks", "albums", "artists"]:
+                if item_type in results:
+                    found += [(item_type[:-1], item) for item in results[item_type]["items"] if item is not None]
+                    self.catalog.add_items(item_type[:-1], results[item_type]["items"])
+
+            items = self.build_items(found)
+            best_items, best_score = self.score_items(string_query, items)
 
         if best_score < 50:
             return {"error": f"No results found for '{string_query}'"}
@@ -342,16 +426,23 @@ class LSpotify(LucyModule):
         track_uris = []
         if best_item["type"] == "track":
             track_uris = [best_item["item"]["uri"]]
-        elif best_item["type"] == "album":
+        else:
+            track_uris = self.catalog.get_track_uris(best_item["item"]["uri"])
+        if track_uris is None and best_item["type"] == "album":
             album_tracks = await self._wrapped_spotify_function(self.sp.album_tracks, album_id=best_item["item"]["id"])
+            if "error" in album_tracks:
+                return album_tracks
             track_uris = [track["uri"] for track in album_tracks["items"]]
-        elif best_item["type"] == "artist":
+            self.catalog.set_track_uris(best_item["item"]["uri"], track_uris)
+        elif track_uris is None and best_item["type"] == "artist":
             artist_tracks = await self._wrapped_spotify_function(self.sp.artist_top_tracks, artist_id=best_item["item"]["id"])
+            if "error" in artist_tracks:
+                return artist_tracks
             track_uris = [track["uri"] for track in artist_tracks["tracks"]]
+            self.catalog.set_track_uris(best_item["item"]["uri"], track_uris)
 
         if should_queue:
-            for track_uri in track_uris:
-                response = await self._wrapped_spotify_function(func, uri=track_uri)
+            response = await self._queue_tracks(track_uris)
         else:
             response = await self._wrapped_spotify_function(func, uris=track_uris)
 
@@ -361,7 +452,76 @@ class LSpotify(LucyModule):
         best_item_string = f"{best_item['item']['name']} ({best_item['type']})"
         if best_item["type"] != "artist":
             best_item_string += f" by {best_item['item']['artists'][0]['name']}"
-        return {"status": "playing", "item": best_item_string}
+        result = {"status": "playing", "item": best_item_string}
+        if should_queue:
+            result["queued_tracks"] = len(track_uris)
+        if self.queue_errors:
+            result["queue_errors"] = self.queue_errors
+            self.queue_errors = []
+        return result
+
+    async def _queue_tracks(self, track_uris):
+        """
+        Queues the first track and returns once it is queued, the rest are queued in order in the
+        background over the pooled connection. Failures are reported with the next play result.
+        """
+        if self.queue_task is not None and not self.queue_task.done():
+            # Keep these behind the tracks of an earlier album still being queued
+            await self.queue_task
+        response = await self._wrapped_spotify_function(self.sp.add_to_queue, uri=track_uris[0])
+        if response is not None and "error" in response:
+            return response
+        if len(track_uris) > 1:
+            self.queue_task = asyncio.create_task(self._queue_rest(track_uris[1:]))
+        return response
+
+    async def _queue_rest(self, track_uris):
+        # One at a time, the queue keeps the order requests arrive in
+        failed = 0
+        for track_uri in track_uris:
+            response = await self._wrapped_spotify_function(self.sp.add_to_queue, uri=track_uri)
+            if response is not None and "error" in response:
+                failed += 1
+        if failed:
+            print(f"Failed to queue {failed} of {len(track_uris) + 1} tracks")
+            self.queue_errors.append(f"{failed} of the last {len(track_uris) + 1} tracks could not be queued")
+
+    def build_items(self, found):
+        """Turns (type, spotify item) pairs into scoring entries, dropping duplicates."""
+        items = []
+        added = set()
+        for item_type, item in found:
+            nat_lang_str = self.build_natrual_language_str(item_type, item).lower()
+            if nat_lang_str in added:
+                continue
+            items.append({"type": item_type, "item": item, "utterence": self.build_utterences(item_type, item)})
+            added.add(nat_lang_str)
+        return items
+
+    def score_items(self, string_query, items, liked_boost=True):
+        """Returns the items whose best utterence scores highest against the query, and that score."""
+        utterences = []
+        owners = []
+        for i, entry in enumerate(items):
+            for utterence in entry["utterence"]:
+                utterences.append(utterence)
+                owners.append(i)
+        if len(utterences) == 0:
+            return [], 0
+
+        scores = FuzzyMatcher(utterences).scores(string_query)
+        # boost score by 20 if in liked songs
+        boosts = np.array([
+            20 if liked_boost and entry["type"] == "track" and self.liked_songs.contains(entry["item"]["uri"]) else 0
+            for entry in items
+        ], dtype=np.int64)
+        scores = scores + boosts[np.array(owners)]
+
+        best_score = int(scores.max())
+        if best_score <= 0:
+            return [], 0
+        best_owners = sorted({owners[i] for i in np.flatnonzero(scores == best_score)})
+        return [items[i] for i in best_owners], best_score
 
     @available_for_lucy
     async def get_current_playback(self):
@@ -371,7 +531,7 @@ class LSpotify(LucyModule):
         if self.is_logged_in == False:
             return {"error": "Not logged in to Spotify."}
         
-        current_playback = await self._wrapped_spotify_function(self.sp.current_playback)
+        current_playback = await self._cached_spotify_function(self.sp.current_playback)
         print("Current playback:", current_playback)
         if current_playback is None or current_playback.get("item") is None:
             return {"status": "no_song_playing"}
@@ -413,18 +573,27 @@ class LSpotify(LucyModule):
         if self.is_logged_in == False:
             return {"error": "Not logged in to Spotify."}
         
-        current_playback = await self._wrapped_spotify_function(self.sp.current_playback)
+        current_playback = await self._cached_spotify_function(self.sp.current_playback)
         if current_playback is None or current_playback.get("item") is None:
             return {"error": "No song is currently playing"}
         track_id = current_playback["item"]["id"]
-        await self._wrapped_spotify_function(self.sp.current_user_saved_tracks_add, tracks=[track_id])
-        self.liked_songs.update_liked_songs_cache()
+        response = await self._wrapped_spotify_function(self.sp.current_user_saved_tracks_add, tracks=[track_id])
+        if response is not None and "error" in response:
+            return response
+        track = slim_track(current_playback["item"])
+        self.liked_songs.add_tracks({track["uri"]: track})
+        self.catalog.add_items("track", [track], persist=False)
         return {"status": "liked", "item": f"{current_playback['item']['name']} by {current_playback['item']['artists'][0]['name']}"}
 
     async def handle_message(self, message):
         print(f"Received message in LSpotify: {message}")
         if message["message"] == "SPOTIFY_STREAMING_INITIATED":
-            self.player_is_loaded = True
+            self.device_id = message.get("device_id", self.device_id)
+            self.player_ready.set()
+        elif message["message"] == "SPOTIFY_STREAMING_STOPPED":
+            self.player_ready.clear()
+            self.player_init_sent = False
+            self.device_id = None
 
     # GLOBAL AUTH STUFF
     state_map = {}
@@ -451,7 +620,7 @@ class LSpotify(LucyModule):
             
 
 
-    def get_web_preview(self, path=None, args={}):
+    async def get_web_preview(self, path=None, args={}):
         if path == "web_player":
             html_path = resources.files("lucyserver.tools").joinpath("lspotify.html")
 
@@ -488,26 +657,20 @@ class LSpotify(LucyModule):
                     "type": "html",
                     "content": "<h1>State mismatch. Please try logging in again.</h1>",
                 }
-            url = "https://accounts.spotify.com/api/token"
             form_data = {
                 "grant_type": "authorization_code",
                 "code": code,
                 "redirect_uri": REDIRECT_URL,
             }
-            authorization = self.CLIENT_ID + ":" + self.CLIENT_SECRET
-            authorization = base64.b64encode(authorization.encode("ascii")).decode("ascii")
-            headers = {
-                "Content-Type": "application/x-www-form-urlencoded",
-                "Authorization": "Basic " + authorization
-            }
-            response = requests.post(url, data=form_data, headers=headers)
-            if response.status_code != 200:
-                print("Error getting tokens:", response.status_code, response.text)
+            status, tokens = await request_token(self.CLIENT_ID, self.CLIENT_SECRET, form_data)
+            if status != 200:
+                print("Error getting tokens:", status, tokens)
                 return {
                     "type": "html",
                     "content": "<h1>Error getting tokens. Please try logging in again.</h1>",
                 }
-            self.set_tokens(response.json())
+            await self.set_tokens(tokens)
+            self.library_sync.sync_soon()
             return {
                 "type": "html",
                 "content": "<h1>Successfully logged in to Spotify! You can now close this window.</h1><script>setTimeout(() => { window.close(); }, 2000);</script>",
@@ -520,95 +683,82 @@ class LSpotify(LucyModule):
 
     
 class UserPlaylists:
-    def __init__(self, sp, save_data_func, load_data_func):
-        self.sp = sp
-        self.save_data_func = save_data_func
+    def __init__(self, save_items_func, load_data_func):
+        self.save_items_func = save_items_func
         self.load_data_func = load_data_func
+        self.matcher = None
     
     def get_user_playlists_cache(self):
-        return self.load_data_func("user_playlists_cache")
+        return self.load_data_func("user_playlists_cache", {})
     
-    def update_user_playlists_cache(self):
-        playlists = {}
-        offset = 0
-        while True:
-            print("Reading from " + str(offset) + "...")
-            results = self.sp.current_user_playlists(limit=50, offset=offset)
-            print("Found", len(results['items']), "playlists")
-            for item in results['items']:
-                playlists[item['id']] = item
-            if len(results['items']) < 50:
-                break
-            offset += 50
-        self.save_data_func("user_playlists_cache", playlists)
+    def update(self, playlists, removed=()):
+        self.save_items_func("user_playlists_cache", playlists, removed)
+        self.matcher = None
 
     def fuzzy_search(self, query: str, return_amount: int = 5):
         playlists = self.get_user_playlists_cache()
-        best_playlists = []
+        if self.matcher is None or self.matcher_ids != list(playlists.keys()):
+            self.matcher_ids = list(playlists.keys())
+            self.matcher = FuzzyMatcher([playlists[playlist_id]["name"] for playlist_id in self.matcher_ids])
 
-        for playlist_id in playlists:
-            playlist = playlists[playlist_id]
-            name = playlist["name"]
-            score = fuzz.ratio(query.lower(), name.lower())
-            best_playlists.append((score, playlist))
-
-        best_playlists.sort(key=lambda x: x[0], reverse=True)
-        best_playlists = best_playlists[:return_amount]
-
-        return best_playlists
+        best_playlists = self.matcher.top_k(query, return_amount)
+        return [(score, playlists[self.matcher_ids[i]]) for score, i in best_playlists]
 
 class LikedSongs:
-    def __init__(self, sp, save_data_func, load_data_func):
-        self.sp = sp
-        self.save_data_func = save_data_func
+    def __init__(self, save_items_func, load_data_func):
+        self.save_items_func = save_items_func
         self.load_data_func = load_data_func
 
+        # Built from the cache the first time it is needed, then kept up to date as songs are added
+        self.index_built = False
+        self.uris = set()
+        self.by_name = {}
+
     def get_liked_songs_cache(self):
         return self.load_data_func("liked_songs_cache", {})
-    
-    def update_liked_songs_cache(self):
-        MAX_SONGS = 10000000
-
-        offset = 0
-        songs = self.load_data_func("liked_songs_cache", {})
-
-        while True:
-            caught_up = False
-
-            print("Reading from " + str(offset) + "...")
-            results = self.sp.current_user_saved_tracks(limit=50, offset=offset)
-            print("Found", len(results['items']), "songs")
-            for item in results['items']:
-                track = item['track']
-                song_id = "spotify:track:" + track['id']
-                if song_id in songs:
-                    caught_up = True
-                    break
-                songs[song_id] = track
-                if len(songs) >= MAX_SONGS:
-                    break
-            if len(songs) >= MAX_SONGS or caught_up:
-                break
-            offset += 50
-            if len(results['items']) == 0:
-                break
-
-        self.save_data_func("liked_songs_cache", songs)
+
+    def build_index(self):
+        self.uris = set()
+        self.by_name = {}
+        self.index_built = True
+        self.index_tracks(self.get_liked_songs_cache())
+
+    def index_tracks(self, songs):
+        if not self.index_built:
+            return
+        for song_id, track in songs.items():
+            self.uris.add(song_id)
+            # setdefault so the first song with a name wins, like the old linear scan
+            self.by_name.setdefault(clean_name(track["name"]), song_id)
+
+    def ensure_index(self):
+        if not self.index_built:
+            self.build_index()
+
+    def contains(self, uri):
+        self.ensure_index()
+        return uri in self.uris
+
+    def add_tracks(self, songs, removed=()):
+        self.save_items_func("liked_songs_cache", songs, removed)
+        if removed:
+            self.index_built = False
+        else:
+            self.index_tracks(songs)
 
     def get(self):
         songs = self.get_liked_songs_cache()
         return list(songs.values())
     
     def is_in_liked_songs(self, track_name: str):
-        songs = self.get_liked_songs_cache()
-        for song_id in songs:
-            song = songs[song_id]
-            if song["name"].lower() == track_name.lower():
-                return song
-        return None
+        self.ensure_index()
+        song_id = self.by_name.get(clean_name(track_name))
+        if song_id is None:
+            return None
+        return self.get_liked_songs_cache().get(song_id)
 
     
 if __name__ == "__main__":
     spotify = LSpotify()
     spotify.set_user_id("meewhee")
-    spotify.setup()
\ No newline at end of file
+    asyncio.run(spotify.setup())
\ No newline at end of file
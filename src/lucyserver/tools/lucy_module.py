@@ -1,11 +1,19 @@
 import inspect
-import os
-import json
+
+from .data_store import data_store
 
 def available_for_lucy(func):
     func._available_for_lucy = True
     return func
 
+def callable_by_lucy(func):
+    """
+    Lets Lucy call the function without listing it in the module's documentation, for functions
+    that are handed out by another function (like LHome.get_device_functions).
+    """
+    func._callable_by_lucy = True
+    return func
+
 class LucyModule:
     def __init__(self, name):
         self.name = name
@@ -36,6 +44,13 @@ class LucyModule:
         """
         pass
 
+    def teardown(self):
+        """
+        This method is called when the session the module belongs to is removed.
+        Subclasses that start background tasks should stop them here.
+        """
+        pass
+
     async def handle_message(self, message):
         """
         This method is called when a tool message is received.
@@ -44,52 +59,70 @@ class LucyModule:
         raise NotImplementedError("This method should be implemented in subclasses.")
     
     def save_data(self, key, value):
-        base_dir = os.path.expanduser("~/lucyserver/cfg")
-        user_tool_dir = os.path.join(base_dir, self.user_id, self.name)
-        os.makedirs(user_tool_dir, exist_ok=True)
-        
-        file_path = os.path.join(user_tool_dir, f"{key}.json")
-        with open(file_path, "w") as f:
-            f.write(json.dumps(value, indent=4))
+        data_store.save(self.user_id, self.name, key, value)
 
     def load_data(self, key, default):
         if self.name is None or self.user_id is None:
             return default
-        
-        try:
-            base_dir = os.path.expanduser("~/lucyserver/cfg")
-            file_path = os.path.join(base_dir, self.user_id, self.name, f"{key}.json")
-            with open(file_path, "r") as f:
-                return json.load(f)
-        except FileNotFoundError:
-            self.save_data(key, default)
-            return default
+        return data_store.load(self.user_id, self.name, key, default)
 
+    def save_data_items(self, key, items, removed=()):
+        """
+        Adds or replaces entries of a dict saved under key and removes the keys in removed.
+        Storage backends that support it only write the entries that changed.
+        """
+        data_store.save_items(self.user_id, self.name, key, items, removed)
 
-    def get_callable_functions(self):
-        functions = {}
-        functions['module'] = self
-        for name, func in inspect.getmembers(self.__class__, predicate=inspect.isfunction):
-            functions[name] = func
-        return functions
+    def flush_data(self):
+        """Writes any pending save_data calls to disk now instead of waiting for the write-behind."""
+        data_store.flush()
 
-    def build_documentation(self):
-        functions = []
-        for name, func in inspect.getmembers(self.__class__, predicate=inspect.isfunction):
+    def __init_subclass__(cls, **kwargs):
+        """
+        Builds the dispatch table and documentation once per class, shared by every instance.
+        Only functions marked available_for_lucy or callable_by_lucy can be called by name, helpers
+        like save_data or set_user_id can't. handle_message is only called for client messages.
+        """
+        super().__init_subclass__(**kwargs)
+        cls.functions = {}
+        cls.signatures = {}
+        cls.function_docs = {}
+        cls.lucy_functions = []
+        for name, func in inspect.getmembers(cls, predicate=inspect.isfunction):
+            if name.startswith("_"):
+                continue
+            if not (getattr(func, '_available_for_lucy', False) or getattr(func, '_callable_by_lucy', False)):
+                continue
+            sig = inspect.signature(func)
+            arg_names = [str(param) for param in sig.parameters.values()]
+            if "self" in arg_names:
+                arg_names.remove("self")
+            cls.functions[name] = func
+            cls.signatures[name] = sig
+            cls.function_docs[name] = {
+                "function": name,
+                "args": arg_names,
+                "description": inspect.getdoc(func) or "",
+            }
             if getattr(func, '_available_for_lucy', False):
-                functions.append(self.build_documentation_for_func(func))
+                cls.lucy_functions.append(name)
+
+    def has_function(self, name):
+        return name in self.functions
+
+    def bind_call(self, name, args):
+        """Validates args against the function's signature and returns the awaitable call. Raises TypeError on bad args."""
+        bound = self.signatures[name].bind(self, **args)
+        return self.functions[name](*bound.args, **bound.kwargs)
+
+    def build_documentation(self):
+        functions = [self.build_documentation_for_func(self.functions[name]) for name in self.lucy_functions]
         return {"functions": functions}
     
     def build_documentation_for_func(self, func):
-        sig = inspect.signature(func)
-        arg_names = [str(param) for param in sig.parameters.values()]
-        arg_names.remove('self')
-        doc = inspect.getdoc(func) or ""
         return {
             "module": self.name,
-            "function": func.__name__,
-            "args": arg_names,
-            "description": doc,
+            **self.function_docs[func.__name__],
         }
     
     async def send_socket_message(self, json_data):
@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+
+MANIFEST_PATH = os.path.expanduser("~/lucyserver/cache/tool_manifest.json")
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_manifest = None
+
+def source_fingerprint():
+    """Hashes the size and mtime of every tool source file, without importing any of them."""
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(TOOLS_DIR)):
+        if not name.endswith(".py"):
+            continue
+        stat = os.stat(os.path.join(TOOLS_DIR, name))
+        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+    return digest.hexdigest()
+
+def build_manifest():
+    from .linternal import LInternal
+
+    docs = {"internal": LInternal(None, None, None).build_documentation()}
+    for tool_name in LInternal.tool_classes:
+        docs[tool_name] = LInternal.get_tool_class(tool_name)().build_documentation()
+    return docs
+
+def get_manifest():
+    """
+    Returns the documentation of every tool. It is read from a cached manifest when the tool
+    sources haven't changed, so no tool module (or its dependencies) is imported at startup.
+    """
+    global _manifest
+    if _manifest is not None:
+        return _manifest
+
+    fingerprint = source_fingerprint()
+    try:
+        with open(MANIFEST_PATH, "r") as f:
+            cached = json.load(f)
+        if cached["fingerprint"] == fingerprint:
+            _manifest = cached["docs"]
+            return _manifest
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+
+    _manifest = build_manifest()
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"fingerprint": fingerprint, "docs": _manifest}, f)
+    os.replace(tmp_path, MANIFEST_PATH)
+    return _manifest
+
+def get_tool_documentation(name):
+    return get_manifest()[name]
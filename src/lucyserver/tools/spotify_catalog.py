@@ -0,0 +1,184 @@
+import re
+import time
+from collections import OrderedDict
+
+# Words people put around a name ("the song x by y") that say nothing about which item it is
+FILLER_WORDS = {"the", "song", "track", "album", "artist", "by", "a"}
+
+# How long an artist's cached top tracks are trusted before asking Spotify again
+ARTIST_TRACKS_TTL = 24 * 60 * 60
+
+# Entries kept under catalog_cache, the least recently used are dropped past this
+MAX_CACHED_ENTRIES = 10000
+
+def clean_name(name):
+    # Remove text in parentheses
+    name = re.sub(r'\([^)]*\)', '', name)
+
+    # Replace & with 'and'
+    formatted_name = name.replace("&", "and")
+    
+    # Convert to lowercase
+    formatted_name = formatted_name.lower()
+    
+    # Remove non-alphanumeric characters except spaces
+    formatted_name = ''.join(e for e in formatted_name if e.isalnum() or e == ' ')
+    
+    # Remove extra spaces
+    formatted_name = formatted_name.split(" ")
+    formatted_name = [word for word in formatted_name if word != ""]
+    formatted_name = " ".join(formatted_name)
+    
+    return formatted_name
+
+def slim_item(item_type, item):
+    """Keeps only the fields play needs from a Spotify track/album/artist object."""
+    entry = {
+        "type": item_type,
+        "name": item["name"],
+        "uri": item["uri"],
+        "id": item["id"],
+    }
+    if item_type != "artist":
+        entry["artists"] = [{"name": artist["name"], "uri": artist.get("uri"), "id": artist.get("id")} for artist in item.get("artists", [])]
+    return entry
+
+
+class SpotifyCatalog:
+    """
+    Local catalog of the tracks, albums and artists a user has come across (liked songs, playlist
+    contents and earlier search results) with an inverted token index over their names, so most
+    play requests resolve without a Spotify search.
+
+    Search results and playlist contents are persisted under the catalog_cache key, capped at
+    MAX_CACHED_ENTRIES least recently used first. Liked songs are indexed straight from their own
+    cache and are never dropped.
+    """
+
+    def __init__(self, liked_songs, save_items_func, load_data_func):
+        self.liked_songs = liked_songs
+        self.save_items_func = save_items_func
+        self.load_data_func = load_data_func
+
+        self.entries = None
+        self.postings = {}
+        # uris stored in catalog_cache, least recently used first
+        self.cached = OrderedDict()
+        # uris indexed from the library (liked songs), kept even when dropped from catalog_cache
+        self.library = set()
+
+    def ensure_index(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        self.postings = {}
+        self.cached = OrderedDict()
+        self.library = set()
+        cached = self.load_data_func("catalog_cache", {})
+        for entry in sorted(cached.values(), key=lambda entry: entry.get("used", 0)):
+            self._index(entry)
+            self.cached[entry["uri"]] = True
+        tracks = list(self.liked_songs.get_liked_songs_cache().values())
+        self.add_items("track", tracks, persist=False)
+        self._evict()
+
+    def _tokens(self, entry):
+        tokens = set(clean_name(entry["name"]).split())
+        for artist in entry.get("artists", []):
+            tokens.update(clean_name(artist["name"]).split())
+        return tokens
+
+    def _index(self, entry):
+        uri = entry["uri"]
+        if uri in self.entries:
+            # Keep tracks already known for albums/artists
+            self.entries[uri] = {**self.entries[uri], **entry}
+            return False
+        self.entries[uri] = entry
+        for token in self._tokens(entry):
+            self.postings.setdefault(token, set()).add(uri)
+        return True
+
+    def _unindex(self, uri):
+        entry = self.entries.pop(uri)
+        for token in self._tokens(entry):
+            uris = self.postings.get(token)
+            if uris is not None:
+                uris.discard(uri)
+                if not uris:
+                    del self.postings[token]
+
+    def _touch(self, entry):
+        """Marks a cached entry as just used, returns it with the time stored for the next load."""
+        self.cached[entry["uri"]] = True
+        self.cached.move_to_end(entry["uri"])
+        entry = {**entry, "used": int(time.time())}
+        self.entries[entry["uri"]] = entry
+        return entry
+
+    def _evict(self):
+        removed = []
+        while len(self.cached) > MAX_CACHED_ENTRIES:
+            uri, _ = self.cached.popitem(last=False)
+            removed.append(uri)
+            if uri not in self.library:
+                self._unindex(uri)
+        if removed:
+            self.save_items_func("catalog_cache", {}, removed)
+
+    def add_items(self, item_type, items, persist=True):
+        """Adds Spotify track/album/artist objects. Tracks also add their album and artists."""
+        self.ensure_index()
+        new_entries = {}
+        for item in items:
+            if item is None or item.get("uri") is None:
+                continue
+            entries = [slim_item(item_type, item)]
+            if item_type == "track" and item.get("album") and item["album"].get("uri"):
+                entries.append(slim_item("album", item["album"]))
+            if item_type != "artist":
+                entries += [slim_item("artist", artist) for artist in item.get("artists", []) if artist.get("uri")]
+            for entry in entries:
+                is_new = self._index(entry)
+                if not persist:
+                    self.library.add(entry["uri"])
+                elif is_new or entry["uri"] not in self.cached:
+                    new_entries[entry["uri"]] = self._touch(self.entries[entry["uri"]])
+                else:
+                    # Already stored, only the order in memory changes so this doesn't write
+                    self.cached.move_to_end(entry["uri"])
+        if new_entries:
+            self.save_items_func("catalog_cache", new_entries)
+            self._evict()
+
+    def set_track_uris(self, uri, track_uris):
+        """Remembers the tracks to play for an album or artist."""
+        self.ensure_index()
+        if uri not in self.entries:
+            return
+        entry = {**self.entries[uri], "track_uris": track_uris, "track_uris_time": int(time.time())}
+        entry = self._touch(entry)
+        self.save_items_func("catalog_cache", {uri: entry})
+        self._evict()
+
+    def get_track_uris(self, uri):
+        self.ensure_index()
+        entry = self.entries.get(uri)
+        if entry is None or "track_uris" not in entry:
+            return None
+        if uri in self.cached:
+            self.cached.move_to_end(uri)
+        if entry["type"] == "artist" and entry.get("track_uris_time", 0) + ARTIST_TRACKS_TTL < time.time():
+            return None
+        return entry["track_uris"]
+
+    def search(self, query, limit=25):
+        """Returns the entries sharing the most name tokens with the query, best first."""
+        self.ensure_index()
+        tokens = [token for token in clean_name(query).split() if token not in FILLER_WORDS]
+        counts = {}
+        for token in tokens:
+            for uri in self.postings.get(token, ()):
+                counts[uri] = counts.get(uri, 0) + 1
+        best = sorted(counts, key=counts.get, reverse=True)[:limit]
+        return [self.entries[uri] for uri in best]
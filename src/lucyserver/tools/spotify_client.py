@@ -0,0 +1,158 @@
+import asyncio
+import base64
+import time
+
+import httpx
+
+from .http_pool import get_client
+
+API_URL = "https://api.spotify.com/v1"
+ACCOUNTS_URL = "https://accounts.spotify.com"
+
+MAX_RETRIES = 3
+# Never wait longer than this for a Retry-After, the user is waiting for an answer
+MAX_RETRY_AFTER = 10
+
+class SpotifyError(Exception):
+    def __init__(self, status, message, reason=None):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+        self.reason = reason
+
+async def request_token(client_id, client_secret, form_data):
+    """Posts to the accounts token endpoint. Returns (status_code, body)."""
+    authorization = base64.b64encode(f"{client_id}:{client_secret}".encode("ascii")).decode("ascii")
+    headers = {
+        "Content-Type": "application/x-www-form-urlencoded",
+        "Authorization": "Basic " + authorization
+    }
+    try:
+        response = await get_client(ACCOUNTS_URL).post("/api/token", data=form_data, headers=headers)
+    except httpx.HTTPError as e:
+        return 0, str(e)
+    if response.status_code != 200:
+        return response.status_code, response.text
+    return response.status_code, response.json()
+
+
+class SpotifyClient:
+    """
+    Async Spotify Web API client. Method names and arguments follow spotipy.
+
+    All users share one connection pool (see http_pool). get_token is an async callable that
+    returns a valid access token, refreshing it if needed. Identical GETs that are in flight at
+    the same time are sent once, and a 429 pauses every client until Retry-After has passed.
+    """
+
+    # Rate limits are per app, not per user
+    rate_limited_until = 0
+
+    def __init__(self, get_token):
+        self.get_token = get_token
+        self.inflight = {}
+
+    async def request(self, method, path, params=None, json=None):
+        if params is not None:
+            params = {key: value for key, value in params.items() if value is not None}
+        if method != "GET":
+            return await self._send(method, path, params, json)
+
+        key = (path, tuple(sorted((params or {}).items())))
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._send(method, path, params, json))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # shield so one caller being cancelled doesn't cancel the request for the others
+        return await asyncio.shield(task)
+
+    async def _send(self, method, path, params, json):
+        client = get_client(API_URL)
+        for attempt in range(MAX_RETRIES + 1):
+            wait = SpotifyClient.rate_limited_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            token = await self.get_token()
+            try:
+                response = await client.request(method, path, params=params, json=json, headers={"Authorization": f"Bearer {token}"})
+            except httpx.TransportError as e:
+                if attempt == MAX_RETRIES:
+                    raise SpotifyError(0, str(e))
+                await asyncio.sleep(0.2 * 2 ** attempt)
+                continue
+
+            if response.status_code == 429 and attempt < MAX_RETRIES:
+                retry_after = min(float(response.headers.get("Retry-After", 1)), MAX_RETRY_AFTER)
+                SpotifyClient.rate_limited_until = max(SpotifyClient.rate_limited_until, time.monotonic() + retry_after)
+                print(f"Spotify rate limited, retrying in {retry_after}s")
+                continue
+            if response.status_code >= 500 and attempt < MAX_RETRIES:
+                await asyncio.sleep(0.2 * 2 ** attempt)
+                continue
+            if response.status_code >= 400:
+                message, reason = response.text, None
+                try:
+                    error = response.json()["error"]
+                    if isinstance(error, dict):
+                        message, reason = error.get("message", message), error.get("reason")
+                except (ValueError, KeyError, TypeError):
+                    pass
+                raise SpotifyError(response.status_code, message, reason)
+
+            if response.status_code == 204 or not response.content:
+                return None
+            try:
+                return response.json()
+            except ValueError:
+                # Some player endpoints answer with a non-JSON body
+                return None
+
+    def current_playback(self):
+        return self.request("GET", "/me/player")
+
+    def start_playback(self, device_id=None, context_uri=None, uris=None):
+        body = {}
+        if context_uri is not None:
+            body["context_uri"] = context_uri
+        if uris is not None:
+            body["uris"] = uris
+        return self.request("PUT", "/me/player/play", params={"device_id": device_id}, json=body or None)
+
+    def pause_playback(self, device_id=None):
+        return self.request("PUT", "/me/player/pause", params={"device_id": device_id})
+
+    def next_track(self, device_id=None):
+        return self.request("POST", "/me/player/next", params={"device_id": device_id})
+
+    def previous_track(self, device_id=None):
+        return self.request("POST", "/me/player/previous", params={"device_id": device_id})
+
+    def shuffle(self, state, device_id=None):
+        return self.request("PUT", "/me/player/shuffle", params={"state": "true" if state else "false", "device_id": device_id})
+
+    def add_to_queue(self, uri, device_id=None):
+        return self.request("POST", "/me/player/queue", params={"uri": uri, "device_id": device_id})
+
+    def current_user_saved_tracks(self, limit=20, offset=0):
+        return self.request("GET", "/me/tracks", params={"limit": limit, "offset": offset})
+
+    def current_user_saved_tracks_add(self, tracks):
+        ids = [track.split(":")[-1] for track in tracks]
+        return self.request("PUT", "/me/tracks", params={"ids": ",".join(ids)})
+
+    def current_user_playlists(self, limit=50, offset=0):
+        return self.request("GET", "/me/playlists", params={"limit": limit, "offset": offset})
+
+    def playlist_items(self, playlist_id, limit=100, offset=0):
+        return self.request("GET", f"/playlists/{playlist_id}/tracks", params={"limit": limit, "offset": offset})
+
+    def search(self, q, type="track", limit=10):
+        return self.request("GET", "/search", params={"q": q, "type": type, "limit": limit})
+
+    def album_tracks(self, album_id, limit=50, offset=0):
+        return self.request("GET", f"/albums/{album_id}/tracks", params={"limit": limit, "offset": offset})
+
+    def artist_top_tracks(self, artist_id, country="US"):
+        return self.request("GET", f"/artists/{artist_id}/top-tracks", params={"market": country})
@@ -0,0 +1,169 @@
+import asyncio
+
+from .spotify_client import SpotifyError
+
+SYNC_INTERVAL = 30 * 60
+# Wait before trying again after a failed sync, capped at the interval
+RETRY_DELAYS = [30, 2 * 60, 5 * 60, 15 * 60]
+PAGE_SIZE = 50
+# Pages fetched at the same time, per user
+MAX_CONCURRENT_PAGES = 8
+
+def slim_artists(artists):
+    return [{"name": artist["name"], "uri": artist.get("uri"), "id": artist.get("id")} for artist in artists or []]
+
+def slim_track(track):
+    """The fields Lucy uses from a track: its name, uri, artists and album."""
+    album = track.get("album")
+    return {
+        "name": track["name"],
+        "uri": track["uri"],
+        "id": track.get("id"),
+        "artists": slim_artists(track.get("artists")),
+        "album": {
+            "name": album["name"],
+            "uri": album.get("uri"),
+            "id": album.get("id"),
+            "artists": slim_artists(album.get("artists")),
+        } if album else None,
+    }
+
+def slim_playlist(playlist):
+    return {
+        "id": playlist["id"],
+        "uri": playlist["uri"],
+        "name": playlist["name"],
+        "description": playlist.get("description") or "",
+        "snapshot_id": playlist.get("snapshot_id"),
+        "owner": {"display_name": (playlist.get("owner") or {}).get("display_name")},
+        "tracks": {"total": (playlist.get("tracks") or {}).get("total", 0)},
+    }
+
+
+class LibrarySync:
+    """
+    Keeps a user's liked songs, playlists and the catalog in sync with Spotify in the background.
+
+    Runs right away and then every interval seconds. The first page of a collection gives its
+    total, after that the remaining pages are fetched concurrently. Playlists whose snapshot_id
+    hasn't changed are skipped, and only slim copies of tracks and playlists are stored.
+    """
+
+    def __init__(self, sp, liked_songs, user_playlists, catalog, interval=SYNC_INTERVAL):
+        self.sp = sp
+        self.liked_songs = liked_songs
+        self.user_playlists = user_playlists
+        self.catalog = catalog
+        self.interval = interval
+
+        self.page_semaphore = asyncio.Semaphore(MAX_CONCURRENT_PAGES)
+        self.wake = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def sync_soon(self):
+        self.wake.set()
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        failures = 0
+        while True:
+            self.wake.clear()
+            timeout = self.interval
+            try:
+                await self.sync()
+                failures = 0
+            except Exception as e:
+                # Anything (a Spotify error, an unexpected payload, a bad response) only skips this
+                # round, the loop has to keep running for as long as the session does
+                print("Spotify library sync failed:", repr(e))
+                timeout = min(RETRY_DELAYS[min(failures, len(RETRY_DELAYS) - 1)], self.interval)
+                failures += 1
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def sync(self):
+        await asyncio.gather(self.sync_liked_songs(), self.sync_playlists())
+
+    async def fetch_pages(self, func, offsets, **kwargs):
+        async def fetch(offset):
+            async with self.page_semaphore:
+                return await func(limit=PAGE_SIZE, offset=offset, **kwargs)
+        return await asyncio.gather(*[fetch(offset) for offset in offsets])
+
+    async def fetch_all(self, func, first=None, **kwargs):
+        """Returns the items of every page, in order."""
+        if first is None:
+            first = await self.fetch_pages(func, [0], **kwargs)
+            first = first[0]
+        pages = [first] + await self.fetch_pages(func, range(PAGE_SIZE, first["total"], PAGE_SIZE), **kwargs)
+        return [item for page in pages for item in page["items"]]
+
+    async def sync_liked_songs(self):
+        known = self.liked_songs.get_liked_songs_cache()
+        first = await self.sp.current_user_saved_tracks(limit=PAGE_SIZE, offset=0)
+        total = first["total"]
+
+        # Liked songs are newest first, so when nothing was unliked the new ones are the first
+        # total - known songs. Fetch the pages holding those (and the first known one) all at once.
+        end = min(total, max(total - len(known), 0) + 1)
+        pages = [first] + await self.fetch_pages(self.sp.current_user_saved_tracks, range(PAGE_SIZE, end, PAGE_SIZE))
+        new_songs = {}
+        caught_up = False
+        for item in (item for page in pages for item in page["items"]):
+            track = item["track"]
+            if track is None or track.get("id") is None:
+                continue
+            if track["uri"] in known:
+                caught_up = True
+                break
+            new_songs[track["uri"]] = slim_track(track)
+
+        removed = []
+        if len(known) + len(new_songs) != total or (not caught_up and known):
+            # Songs were unliked (or the order changed), only a full pass can tell which
+            items = await self.fetch_all(self.sp.current_user_saved_tracks, first=first)
+            songs = {item["track"]["uri"]: item["track"] for item in items if item["track"] is not None and item["track"].get("id")}
+            new_songs = {uri: slim_track(track) for uri, track in songs.items() if uri not in known}
+            removed = [uri for uri in known if uri not in songs]
+
+        if new_songs or removed:
+            print(f"Liked songs: {len(new_songs)} new, {len(removed)} removed")
+            self.liked_songs.add_tracks(new_songs, removed)
+            self.catalog.add_items("track", list(new_songs.values()), persist=False)
+
+    async def sync_playlists(self):
+        known = self.user_playlists.get_user_playlists_cache()
+        playlists = [playlist for playlist in await self.fetch_all(self.sp.current_user_playlists) if playlist is not None]
+
+        changed = [playlist for playlist in playlists if known.get(playlist["id"], {}).get("snapshot_id") != playlist.get("snapshot_id")]
+        current_ids = {playlist["id"] for playlist in playlists}
+        removed = [playlist_id for playlist_id in known if playlist_id not in current_ids]
+        if not changed and not removed:
+            return
+
+        print(f"Playlists: {len(changed)} changed, {len(removed)} removed")
+        self.user_playlists.update({playlist["id"]: slim_playlist(playlist) for playlist in changed}, removed)
+
+        # Index what's in the changed playlists so play can find those tracks locally
+        results = await asyncio.gather(
+            *[self.fetch_all(self.sp.playlist_items, playlist_id=playlist["id"]) for playlist in changed],
+            return_exceptions=True
+        )
+        for playlist, items in zip(changed, results):
+            if isinstance(items, SpotifyError):
+                print(f"Could not read playlist {playlist['name']}:", items)
+                continue
+            if isinstance(items, BaseException):
+                raise items
+            tracks = [item["track"] for item in items if item.get("track") and item["track"].get("type", "track") == "track"]
+            self.catalog.add_items("track", [slim_track(track) for track in tracks])
@@ -0,0 +1,81 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+import weakref
+
+# Renew this long before the token expires, minus up to REFRESH_JITTER so users that logged in
+# together don't all refresh in the same second
+REFRESH_AHEAD = 5 * 60
+REFRESH_JITTER = 60
+RETRY_DELAYS = [5, 15, 60, 120]
+
+class TokenRefreshScheduler:
+    """
+    Server-wide scheduler that renews OAuth tokens ahead of their expiry.
+
+    Owners are kept in a heap ordered by when they are due. When due,
+    `await owner.scheduled_refresh()` is called: it returns True on success (and is expected to
+    schedule the new expiry), False when the refresh failed but is worth retrying.
+
+    Owners must call unschedule when they are torn down. The heap only holds weak references, but
+    that is a fallback, not cleanup.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        # owner -> sequence number of its live heap entry, older entries are skipped
+        self.current = weakref.WeakKeyDictionary()
+        self.wake = asyncio.Event()
+        self.task = None
+
+    def schedule(self, owner, expires_at):
+        due = expires_at - REFRESH_AHEAD - random.uniform(0, REFRESH_JITTER)
+        self._push(owner, due, 0)
+
+    def unschedule(self, owner):
+        self.current.pop(owner, None)
+
+    def _push(self, owner, due, attempt):
+        seq = next(self.counter)
+        self.current[owner] = seq
+        heapq.heappush(self.heap, (due, seq, weakref.ref(owner), attempt))
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        self.wake.set()
+
+    async def run(self):
+        while True:
+            self.wake.clear()
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                _, seq, owner_ref, attempt = heapq.heappop(self.heap)
+                owner = owner_ref()
+                if owner is None or self.current.get(owner) != seq:
+                    continue
+                asyncio.create_task(self._refresh(owner, seq, attempt))
+
+            timeout = self.heap[0][0] - now if self.heap else None
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _refresh(self, owner, seq, attempt):
+        try:
+            refreshed = await owner.scheduled_refresh()
+        except Exception as e:
+            print("Error in scheduled token refresh:", e)
+            refreshed = False
+        if refreshed or self.current.get(owner) != seq:
+            return
+        if attempt >= len(RETRY_DELAYS):
+            print("Giving up on scheduled token refresh, it will happen on next use")
+            self.unschedule(owner)
+            return
+        self._push(owner, time.time() + RETRY_DELAYS[attempt], attempt + 1)
+
+
+refresh_scheduler = TokenRefreshScheduler()
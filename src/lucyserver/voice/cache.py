@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from contextlib import aclosing
+import numpy as np
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split())
+
+class PhraseCache:
+    """
+    Content-addressed cache of synthesized sentences.
+
+    Hot entries are kept in memory, everything else lives on disk as raw float32 files that are
+    read back into memory on a hit. Both tiers are size bounded and evict the least recently used
+    entry. put writes a file, so it is called from a worker thread; the lock guards both tiers.
+    """
+
+    def __init__(self, cache_dir="~/lucyserver/tts_cache", max_memory_bytes=32 * 1024 * 1024, max_disk_bytes=512 * 1024 * 1024):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk = None
+        self.disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+
+    def key(self, voice_name, sample_rate, text):
+        raw = f"{voice_name}|{sample_rate}|{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.f32")
+
+    def _load_disk_index(self):
+        # Oldest first, using mtime as the last use time so LRU order survives restarts
+        self.disk = OrderedDict()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".f32"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_bytes += size
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return self.memory[key]
+
+            if self.disk is None:
+                self._load_disk_index()
+            if key in self.disk:
+                try:
+                    # A copy, not a memmap, so the memory tier doesn't depend on the file staying around
+                    audio = np.fromfile(self._path(key), dtype=np.float32)
+                    os.utime(self._path(key))
+                except (OSError, ValueError):
+                    # Gone already, possibly evicted by a put in another thread
+                    self.disk_bytes -= self.disk.pop(key, 0)
+                else:
+                    self.disk.move_to_end(key)
+                    self.disk_hits += 1
+                    self._remember(key, audio)
+                    return audio
+
+            self.misses += 1
+            return None
+
+    def put(self, key, audio):
+        """Stores the audio in both tiers. Writes to disk, so call it off the event loop."""
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        with self.lock:
+            self._remember(key, audio)
+            if self.disk is None:
+                self._load_disk_index()
+            if key in self.disk:
+                return
+
+        tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio.tobytes())
+        os.replace(tmp_path, self._path(key))
+
+        evicted = []
+        with self.lock:
+            if key in self.disk:
+                return
+            self.disk[key] = audio.nbytes
+            self.disk_bytes += audio.nbytes
+            while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+                old_key, size = self.disk.popitem(last=False)
+                self.disk_bytes -= size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def _remember(self, key, audio):
+        if key in self.memory:
+            return
+        self.memory[key] = audio
+        self.memory_bytes += audio.nbytes
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            _, old_audio = self.memory.popitem(last=False)
+            self.memory_bytes -= old_audio.nbytes
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_bytes,
+            "disk_entries": len(self.disk) if self.disk is not None else 0,
+            "disk_bytes": self.disk_bytes,
+        }
+
+
+class CachedVoice:
+    """Wraps a voice engine so sentences it has said before are streamed from the PhraseCache."""
+
+    def __init__(self, voice, cache=None):
+        self.voice = voice
+        self.cache = cache if cache is not None else PhraseCache()
+        self.name = voice.name
+        self.sample_rate = voice.sample_rate
+
+    async def generate(self, text):
+        key = self.cache.key(self.name, self.sample_rate, text)
+        audio = self.cache.get(key)
+        if audio is not None:
+            chunk_size = self.sample_rate // 10
+            for i in range(0, audio.size, chunk_size):
+                yield np.array(audio[i:i+chunk_size])
+            return
+
+        chunks = []
+        async with aclosing(self.voice.generate(text)) as audio_chunks:
+            async for audio_chunk in audio_chunks:
+                chunks.append(audio_chunk)
+                yield audio_chunk
+
+        # Only reached if the whole sentence was synthesized and consumed
+        if chunks:
+            await asyncio.to_thread(self.cache.put, key, np.concatenate(chunks))
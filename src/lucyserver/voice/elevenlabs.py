@@ -1,17 +1,21 @@
+import asyncio
 import threading
-from multiprocessing import Queue
 import numpy as np
-import time
 from elevenlabs.client import ElevenLabs
-import base64
 import subprocess
 
+# 50ms of 16 bit mono PCM at 48kHz
+FRAME_BYTES = 4800
+
 class ElevenLabsAIVoice:
     def __init__(self, api_key, voice_id):
         self.client = ElevenLabs(api_key=api_key)
 
         self.model_id = "eleven_multilingual_v2"
         self.voice_id = voice_id
+        self.sample_rate = 48000
+        self.name = f"elevenlabs:{voice_id}:{self.model_id}"
+        self.decoders = DecoderPool(self.sample_rate)
 
 
     # def generate(self, text):        
@@ -72,52 +76,117 @@ class ElevenLabsAIVoice:
 
     #     print("FFmpeg process ended.")
 
-    def generate(self, text):        
-        yield {"type": "speech_sr", "sr": 48000}
-        audio_stream = self.client.text_to_speech.stream(
-            text=text,
-            voice_id=self.voice_id,
-            model_id=self.model_id,
-        )
-
-        print("ElevenLabs audio stream started.")
-        ffmpeg_proc = subprocess.Popen(
+    def start(self):
+        self.decoders.fill()
+
+    async def generate(self, text):
+        loop = asyncio.get_running_loop()
+        pcm_queue = asyncio.Queue()
+        decoder = self.decoders.take()
+        stop = threading.Event()
+        errors = []
+
+        def feed_decoder():
+            try:
+                audio_stream = self.client.text_to_speech.stream(
+                    text=text,
+                    voice_id=self.voice_id,
+                    model_id=self.model_id,
+                )
+                for chunk in audio_stream:
+                    if chunk is None or stop.is_set():
+                        break
+                    decoder.stdin.write(chunk)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                try:
+                    # Signal EOF to ffmpeg
+                    decoder.stdin.close()
+                except OSError:
+                    pass
+
+        def read_decoder():
+            while True:
+                pcm_data = decoder.stdout.read(FRAME_BYTES)
+                if not pcm_data:
+                    break
+                loop.call_soon_threadsafe(pcm_queue.put_nowait, pcm_data)
+            loop.call_soon_threadsafe(pcm_queue.put_nowait, None)
+
+        threading.Thread(target=feed_decoder, daemon=True).start()
+        threading.Thread(target=read_decoder, daemon=True).start()
+
+        finished = False
+        leftover = b""
+        try:
+            while True:
+                pcm_data = await pcm_queue.get()
+                if pcm_data is None:
+                    finished = True
+                    if errors:
+                        raise RuntimeError(f"ElevenLabs stream failed: {errors[0]}")
+                    break
+                pcm_data = leftover + pcm_data
+                usable = len(pcm_data) - len(pcm_data) % 2
+                leftover = pcm_data[usable:]
+                if usable == 0:
+                    continue
+                yield np.frombuffer(pcm_data[:usable], dtype=np.int16).astype(np.float32) / 32768.0
+        finally:
+            stop.set()
+            if not finished:
+                decoder.kill()
+            await asyncio.to_thread(decoder.wait)
+
+
+class DecoderPool:
+    """
+    Keeps a warm ffmpeg mp3 -> PCM process ready so an utterance never waits on process startup.
+    Taking a decoder immediately spawns its replacement in the background.
+    """
+
+    def __init__(self, sample_rate, spares=1):
+        self.sample_rate = sample_rate
+        self.spares = spares
+        self.lock = threading.Lock()
+        self.ready = []
+
+    def _spawn(self):
+        return subprocess.Popen(
             [
                 'ffmpeg',
                 '-hide_banner',
                 '-loglevel', 'error',
                 '-nostdin',               # don't wait for console input
+                '-probesize', '32',       # start decoding after the first frames
+                '-analyzeduration', '0',
+                '-f', 'mp3',
                 '-i', 'pipe:0',
                 '-f', 's16le',
                 '-acodec', 'pcm_s16le',
                 '-ac', '1',
-                '-ar', '48000',
+                '-ar', str(self.sample_rate),
+                '-flush_packets', '1',
                 'pipe:1'
             ],
             stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE
+            stdout=subprocess.PIPE,
+            bufsize=0
         )
 
-        print("FFmpeg process started.")
-
-        for chunk in audio_stream:
-            if chunk is None:
-                break
-            ffmpeg_proc.stdin.write(chunk)
-
-        # Signal EOF to ffmpeg
-        ffmpeg_proc.stdin.close()
-
-        # Read all PCM data after ffmpeg finishes
-        pcm_data_all = ffmpeg_proc.stdout.read()
-        ffmpeg_proc.wait()
-
-        # Convert to float and yield
-        audio_data = np.frombuffer(pcm_data_all, dtype=np.int16).astype(np.float32) / 32768.0
-        output_bytes = base64.b64encode(audio_data.tobytes()).decode('utf-8')
-        yield {"type": "audio", "data": output_bytes}
-
-        print("FFmpeg process ended.")
+    def fill(self):
+        with self.lock:
+            while len(self.ready) < self.spares:
+                self.ready.append(self._spawn())
+
+    def take(self):
+        with self.lock:
+            decoder = self.ready.pop(0) if self.ready else None
+        if decoder is None or decoder.poll() is not None:
+            decoder = self._spawn()
+        threading.Thread(target=self.fill, daemon=True).start()
+        return decoder
 
 
 voice = ElevenLabsAIVoice(api_key="", voice_id="odyUrTN5HMVKujvVAgWW")
\ No newline at end of file
@@ -1,29 +1,174 @@
-import time
-from multiprocessing import Process, Queue, Value
-from queue import Empty
-import pyaudio
-import numpy as np
+import asyncio
+import itertools
+import multiprocessing
+import os
 import threading
-import base64
+import numpy as np
+
+SAMPLE_RATE = 24000
+CHUNK_SIZE = 2400
+
+def _worker_main(worker_index, jobs, results, cancelled, threads, cpus):
+    """Runs in a worker process. Loads the Kokoro pipeline once and serves text jobs until told to stop."""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+
+    from kokoro import KPipeline
+    pipeline = KPipeline(lang_code='a', repo_id='hexgrad/Kokoro-82M')
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, text, voice_name = job
+        results.put(("start", job_id, worker_index))
+        try:
+            for gs, ps, audio in pipeline(text, voice=voice_name):
+                if cancelled[worker_index] == job_id:
+                    break
+                audio = np.asarray(audio, dtype=np.float32)
+                for i in range(0, audio.size, CHUNK_SIZE):
+                    audio_clip = audio[i:i+CHUNK_SIZE]
+                    if audio_clip.size < CHUNK_SIZE:
+                        audio_clip = np.pad(audio_clip, (0, CHUNK_SIZE - audio_clip.size), mode='constant')
+                    results.put(("chunk", job_id, audio_clip.tobytes()))
+            results.put(("done", job_id, None))
+        except Exception as e:
+            results.put(("error", job_id, str(e)))
 
-from kokoro import KPipeline
 
 class KokoroVoice:
-    def __init__(self):
-        self.pipeline = KPipeline(lang_code='a', repo_id='hexgrad/Kokoro-82M')
-
-    def generate(self, text):
-        yield {"type": "speech_sr", "sr": 24000}
-        generator = self.pipeline(text, voice='af_bella')
-        for i, (gs, ps, audio) in enumerate(generator):
-            audio = np.array(audio)
-            for i in range(0, audio.size, 2400):
-                audio_clip = audio[i:i+2400]
-                if audio_clip.size < 2400:
-                    audio_clip = np.pad(audio_clip, (0, 2400 - audio_clip.size), mode='constant')
-                output_bytes = audio_clip.tobytes()
-                output_bytes = base64.b64encode(output_bytes).decode('utf-8')
-                yield {"type": "audio", "data": output_bytes}
-
-
-voice = KokoroVoice()
\ No newline at end of file
+    """
+    Kokoro TTS served by a pool of worker processes. Each worker loads KPipeline once and takes
+    jobs from a shared queue, so synthesis never runs on the event loop and scales with cores.
+
+    num_workers: number of worker processes
+    threads_per_worker: torch threads per worker (None leaves the torch default)
+    pin_cpus: pin each worker to its own slice of the available CPUs (Linux only)
+    """
+
+    def __init__(self, num_workers=2, threads_per_worker=2, pin_cpus=True, voice_name='af_bella'):
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.pin_cpus = pin_cpus
+        self.voice_name = voice_name
+        self.sample_rate = SAMPLE_RATE
+        self.name = f"kokoro:{voice_name}"
+
+        self.started = False
+        self.start_lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        self.streams = {}
+        # job_workers: job id -> worker index (None while queued), until the job is done.
+        # Shared between the event loop and the router thread, guarded by jobs_lock.
+        self.jobs_lock = threading.Lock()
+        self.job_workers = {}
+        self.pending_cancels = set()
+
+    def _worker_cpus(self, worker_index):
+        if not self.pin_cpus or not hasattr(os, "sched_getaffinity"):
+            return None
+        cpus = sorted(os.sched_getaffinity(0))
+        per_worker = max(1, len(cpus) // self.num_workers)
+        start = (worker_index * per_worker) % len(cpus)
+        return cpus[start:start + per_worker]
+
+    def start(self):
+        with self.start_lock:
+            if self.started:
+                return
+            ctx = multiprocessing.get_context("spawn")
+            self.jobs = ctx.Queue()
+            self.results = ctx.Queue()
+            self.cancelled = ctx.Array('q', self.num_workers, lock=False)
+            self.workers = []
+            for worker_index in range(self.num_workers):
+                worker = ctx.Process(
+                    target=_worker_main,
+                    args=(worker_index, self.jobs, self.results, self.cancelled, self.threads_per_worker, self._worker_cpus(worker_index)),
+                    daemon=True
+                )
+                worker.start()
+                self.workers.append(worker)
+
+            self.router = threading.Thread(target=self._route_results, daemon=True)
+            self.router.start()
+            self.started = True
+
+    def stop(self):
+        if not self.started:
+            return
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+        self.results.put(None)
+        self.started = False
+
+    def _route_results(self):
+        while True:
+            result = self.results.get()
+            if result is None:
+                break
+            kind, job_id, data = result
+            if kind == "start":
+                with self.jobs_lock:
+                    self.job_workers[job_id] = data
+                    if job_id in self.pending_cancels:
+                        self.pending_cancels.discard(job_id)
+                        self.cancelled[data] = job_id
+                continue
+            if kind in ("done", "error"):
+                with self.jobs_lock:
+                    self.job_workers.pop(job_id, None)
+                    self.pending_cancels.discard(job_id)
+            stream = self.streams.get(job_id)
+            if stream is None:
+                continue
+            loop, queue = stream
+            loop.call_soon_threadsafe(queue.put_nowait, (kind, data))
+
+    def _cancel(self, job_id):
+        with self.jobs_lock:
+            if job_id not in self.job_workers:
+                # Already finished
+                return
+            worker_index = self.job_workers[job_id]
+            if worker_index is not None:
+                self.cancelled[worker_index] = job_id
+            else:
+                # Not picked up by a worker yet, the router cancels it when it starts
+                self.pending_cancels.add(job_id)
+
+    async def generate(self, text):
+        self.start()
+
+        job_id = next(self.job_ids)
+        queue = asyncio.Queue()
+        self.streams[job_id] = (asyncio.get_running_loop(), queue)
+        with self.jobs_lock:
+            self.job_workers[job_id] = None
+        self.jobs.put((job_id, text, self.voice_name))
+
+        finished = False
+        try:
+            while True:
+                kind, data = await queue.get()
+                if kind == "chunk":
+                    yield np.frombuffer(data, dtype=np.float32)
+                elif kind == "error":
+                    finished = True
+                    raise RuntimeError(f"Kokoro worker error: {data}")
+                else:
+                    finished = True
+                    break
+        finally:
+            del self.streams[job_id]
+            if not finished:
+                self._cancel(job_id)
+
+
+voice = KokoroVoice()
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lucyserver.tools.data_store import DataStore, JsonFileBackend, SQLiteBackend
+
+
+def read_or_none(backend, entry_key):
+    try:
+        return backend.read(entry_key)[0]
+    except KeyError:
+        return None
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def make_backend(kind, tmp_path):
+    if kind == "sqlite":
+        return SQLiteBackend(str(tmp_path / "test.db"))
+    return JsonFileBackend(str(tmp_path / "cfg"))
+
+
+@pytest.mark.parametrize("kind", ["json", "sqlite"])
+def test_unserializable_key_is_dropped_and_rest_of_batch_is_written(kind, tmp_path):
+    backend = make_backend(kind, tmp_path)
+    store = DataStore(backend)
+
+    circular = {}
+    circular["self"] = circular
+    store.save("user", "mod", "before", {"ok": 1})
+    store.save("user", "mod", "a_set", {1, 2, 3})
+    store.save("user", "mod", "circular", circular)
+    store.save_items("user", "mod", "collection", {"bad": {1}})
+    store.save("user", "mod", "after", [1, 2])
+
+    assert store.flush()
+    assert store.dirty == {}
+
+    assert backend.read(("user", "mod", "before"))[0] == {"ok": 1}
+    assert backend.read(("user", "mod", "after"))[0] == [1, 2]
+    for key in ["a_set", "circular", "collection"]:
+        with pytest.raises(KeyError):
+            backend.read(("user", "mod", key))
+
+
+def test_writer_keeps_running_after_unserializable_value(tmp_path):
+    backend = make_backend("json", tmp_path)
+    store = DataStore(backend, flush_interval=0.01)
+
+    store.save("user", "mod", "bad", {1, 2})
+    store.save("user", "mod", "good", "first")
+    assert wait_for(lambda: read_or_none(backend, ("user", "mod", "good")) == "first")
+
+    # The writer thread is still alive and picks up later saves on its own
+    store.save("user", "mod", "good", "second")
+    assert wait_for(lambda: read_or_none(backend, ("user", "mod", "good")) == "second")
+    assert store.writer.is_alive()
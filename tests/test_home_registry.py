@@ -0,0 +1,86 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+import uvicorn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+
+import fake_hass
+from lucyserver.tools.http_pool import close_clients
+from lucyserver.tools.lhome import LHome
+
+LIGHTS_PER_AREA = 2
+
+
+@pytest.fixture(scope="module")
+def hass_url():
+    fake_hass.seed(LIGHTS_PER_AREA)
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(fake_hass.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not server.started and time.time() < deadline:
+        time.sleep(0.05)
+    assert server.started
+    yield f"http://127.0.0.1:{port}/api"
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+def make_home(hass_url):
+    home = LHome()
+    home.HASS_URL = hass_url
+    home.HASS_TOKEN = "token"
+    return home
+
+
+async def device_states(home):
+    return {device["id"]: device["state"] for device in (await home.get_devices("all"))["devices"]}
+
+
+def test_get_devices_and_state_updates(hass_url):
+    async def run():
+        home = make_home(hass_url)
+        try:
+            garage = await home.get_devices("garage")
+            assert sorted(device["id"] for device in garage["devices"]) == [
+                f"home:device:light.garage_{i}" for i in range(LIGHTS_PER_AREA)
+            ]
+            assert all(device["room"] == "Garage" and device["state"] == "off" for device in garage["devices"])
+
+            # The group's members are hidden behind the group
+            kitchen = await home.get_devices("Kitchen")
+            assert [device["id"] for device in kitchen["devices"]] == ["home:device:light.kitchen_all"]
+
+            everything = await home.get_devices("all")
+            assert len(everything["devices"]) == 2 * LIGHTS_PER_AREA + 1
+
+            missing = await home.get_devices("attic")
+            assert "error" in missing
+            assert sorted(missing["valid_rooms"]) == ["Garage", "Kitchen", "Living Room"]
+
+            # Changes come back over the websocket and show up without another fetch
+            turned_on = ["home:device:light.garage_0", "home:device:light.living_room_1"]
+            assert await home.turn_on_lights(turned_on) == {"status": "success"}
+
+            deadline = time.time() + 5
+            states = await device_states(home)
+            while any(states[device_id] != "on" for device_id in turned_on) and time.time() < deadline:
+                await asyncio.sleep(0.01)
+                states = await device_states(home)
+            assert states["home:device:light.garage_0"] == "on"
+            assert states["home:device:light.living_room_1"] == "on"
+            assert states["home:device:light.garage_1"] == "off"
+        finally:
+            await close_clients()
+
+    asyncio.run(run())
@@ -0,0 +1,128 @@
+import argparse
+import time
+
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+import uvicorn
+
+# Stand-in for a Home Assistant instance, for trying LHome without a real house:
+#   python tools/fake_hass.py --port 8124
+# then point ~/lucyserver/cfg/<user>/home/homeassistant.json at http://127.0.0.1:8124/api
+# (any token works). It implements the parts of the REST and websocket APIs LHome uses.
+# tests/test_home_registry.py runs LHome and the HomeRegistry against it.
+
+app = FastAPI()
+
+AREAS = {"garage": "Garage", "living_room": "Living Room", "kitchen": "Kitchen"}
+DEVICES = {}
+ENTITIES = {}
+STATES = {}
+subscribers = set()
+
+def add_light(entity_id, name, area_id, state="off"):
+    ENTITIES[entity_id] = {"entity_id": entity_id, "area_id": area_id, "device_id": None}
+    STATES[entity_id] = {
+        "entity_id": entity_id,
+        "state": state,
+        "attributes": {"friendly_name": name},
+        "last_changed": time.time(),
+    }
+
+def seed(lights_per_area):
+    for area_id, area_name in AREAS.items():
+        for i in range(lights_per_area):
+            add_light(f"light.{area_id}_{i}", f"{area_name} Light {i}", area_id)
+    # A light group, its members should be hidden by get_devices
+    members = [f"light.kitchen_{i}" for i in range(lights_per_area)]
+    ENTITIES["light.kitchen_all"] = {"entity_id": "light.kitchen_all", "area_id": "kitchen", "device_id": None}
+    STATES["light.kitchen_all"] = {
+        "entity_id": "light.kitchen_all",
+        "state": "off",
+        "attributes": {"friendly_name": "Kitchen Lights", "entity_id": members},
+        "last_changed": time.time(),
+    }
+
+async def set_state(entity_id, state, **attributes):
+    old_state = STATES.get(entity_id)
+    if old_state is None:
+        return None
+    new_state = {
+        **old_state,
+        "state": state,
+        "attributes": {**old_state["attributes"], **attributes},
+        "last_changed": time.time(),
+    }
+    STATES[entity_id] = new_state
+    event = {"event_type": "state_changed", "data": {"entity_id": entity_id, "old_state": old_state, "new_state": new_state}}
+    for ws, subscription_id in list(subscribers):
+        try:
+            await ws.send_json({"id": subscription_id, "type": "event", "event": event})
+        except Exception:
+            subscribers.discard((ws, subscription_id))
+    return new_state
+
+@app.get("/api/states")
+async def get_states():
+    return list(STATES.values())
+
+@app.post("/api/services/{domain}/{service}")
+async def call_service(domain: str, service: str, request: Request):
+    data = await request.json()
+    entity_ids = data.pop("entity_id", [])
+    if isinstance(entity_ids, str):
+        entity_ids = [entity_ids]
+    changed = []
+    for entity_id in entity_ids:
+        if not entity_id.startswith(domain + "."):
+            continue
+        state = "on" if service == "turn_on" else "off" if service == "turn_off" else None
+        if state is None:
+            continue
+        new_state = await set_state(entity_id, state, **data)
+        if new_state is not None:
+            changed.append(new_state)
+    return changed
+
+@app.websocket("/api/websocket")
+async def websocket(ws: WebSocket):
+    await ws.accept()
+    await ws.send_json({"type": "auth_required", "ha_version": "fake"})
+    auth = await ws.receive_json()
+    if auth.get("type") != "auth" or not auth.get("access_token"):
+        await ws.send_json({"type": "auth_invalid", "message": "Invalid access token"})
+        await ws.close()
+        return
+    await ws.send_json({"type": "auth_ok", "ha_version": "fake"})
+
+    results = {
+        "get_states": lambda: list(STATES.values()),
+        "config/area_registry/list": lambda: [{"area_id": area_id, "name": name} for area_id, name in AREAS.items()],
+        "config/device_registry/list": lambda: [{"id": device_id, "area_id": area_id} for device_id, area_id in DEVICES.items()],
+        "config/entity_registry/list": lambda: list(ENTITIES.values()),
+    }
+    try:
+        while True:
+            message = await ws.receive_json()
+            if message["type"] == "subscribe_events":
+                if message.get("event_type") == "state_changed":
+                    subscribers.add((ws, message["id"]))
+                await ws.send_json({"id": message["id"], "type": "result", "success": True, "result": None})
+            elif message["type"] in results:
+                await ws.send_json({"id": message["id"], "type": "result", "success": True, "result": results[message["type"]]()})
+            else:
+                await ws.send_json({"id": message["id"], "type": "result", "success": False, "error": {"code": "unknown_command"}})
+    except WebSocketDisconnect:
+        for subscriber in [s for s in subscribers if s[0] is ws]:
+            subscribers.discard(subscriber)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a stand-in Home Assistant server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8124)
+    parser.add_argument("--lights-per-area", type=int, default=10)
+    args = parser.parse_args()
+
+    seed(args.lights_per_area)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()